@@ -31,9 +31,13 @@
 #
 import array
 from decimal import Decimal
+import itertools
+from loader import convert
+import numpy as np
 import sys
 from math import sqrt
 import time
+from timestamps import LOCAL, TimestampParser
 
 class Row:
     """ Represents a row from the input file
@@ -118,3 +122,177 @@ class Row:
                 self._totalAcc = self._totalAcc + val*val
             self._totalAcc = sqrt(self._totalAcc)
         return self._totalAcc
+
+class RowBatch:
+    """Represents a batch of rows from the input file as NumPy arrays,
+    one element for each line, rather than a Row object for each line,
+    which takes hundreds of bytes.  lines is the list of lines read
+    from the AX3 CSV file, and verbose and decode are as for Row.  skip
+    is a boolean array which is True for the rows that Row would skip,
+    and the other arrays hold NaN, or an empty string, for those rows.
+    tz is the time zone of the timestamps, as for loader.Loader.  It is
+    the local time zone by default, so epoch gives the same times as
+    Row.getEpoch().  Indexing or iterating over the batch gives a
+    RowView for each row, which can be used in place of a Row.
+
+    """
+
+    __slots__ = ("rawLine", "skip", "timestamp", "val",
+                 "_parser", "_epoch", "_totalAcc", "_date", "_time")
+
+    def __init__(self, lines, verbose=True, decode=True, tz=LOCAL):
+        self.rawLine = lines
+        self._parser = TimestampParser(tz)
+        self._epoch = None
+        self._totalAcc = None
+        self._date = None
+        self._time = None
+        self.timestamp = None
+        self.val = None
+
+        headers = np.fromiter(map(str.startswith, lines, itertools.repeat("datetime")),
+                              dtype=bool, count=len(lines))
+        commas = np.fromiter(map(str.count, lines, itertools.repeat(",")),
+                             dtype=np.int64, count=len(lines))
+        self.skip = headers | (commas != 3)
+        for index in np.flatnonzero(self.skip).tolist():
+            if headers[index]:
+                if verbose:
+                    print(f"Skip header line {lines[index]}", file=sys.stderr)
+            else:
+                print(f"Ignore {lines[index]}", file=sys.stderr)
+
+        # Only decode lines if they are actually going to be processed
+        # by the caller
+        if decode:
+            self.timestamp = np.full(len(lines), "")
+            self.val = np.full((len(lines), 3), np.nan)
+            rows = np.flatnonzero(~self.skip)
+            if rows.size > 0:
+                converted, timestamp, x, y, z = convert(
+                    [lines[index].strip() for index in rows.tolist()])
+                self.skip[rows[~converted]] = True
+                rows = rows[converted]
+                self.timestamp = self.timestamp.astype(timestamp.dtype)
+                self.timestamp[rows] = timestamp
+                self.val[rows, 0] = x
+                self.val[rows, 1] = y
+                self.val[rows, 2] = z
+
+    def __len__(self):
+        return self.skip.size
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError("RowBatch index out of range")
+        return RowView(self, index % len(self))
+
+    def __iter__(self):
+        return map(RowView, itertools.repeat(self), range(len(self)))
+
+    @property
+    def epoch(self):
+        """ The timestamps as epochs, seconds since 1/1/1970 """
+        if self.timestamp is None:
+            return None
+        # Lazy evaluation
+        if self._epoch is None:
+            self._epoch = np.full(len(self), np.nan)
+            rows = np.flatnonzero(~self.skip)
+            self._epoch[rows] = self._parser.seconds(self.timestamp[rows])
+        return self._epoch
+
+    @property
+    def tot(self):
+        """ Total acceleration of each row """
+        if self.val is None:
+            return None
+        # Lazy evaluation
+        if self._totalAcc is None:
+            self._totalAcc = np.sqrt((self.val * self.val).sum(axis=1))
+        return self._totalAcc
+
+    @property
+    def date(self):
+        """ Date part of each timestamp """
+        if self.timestamp is None:
+            return None
+        if self._date is None:
+            self._date, self._time = self._split()
+        return self._date
+
+    @property
+    def time(self):
+        """ Time part of each timestamp """
+        if self.timestamp is None:
+            return None
+        if self._time is None:
+            self._date, self._time = self._split()
+        return self._time
+
+    def _split(self):
+        """ Split the timestamps into dates and times """
+        parts = np.char.partition(self.timestamp, " ")
+        return parts[:, 0], parts[:, 2]
+
+class RowView:
+    """ One row of a RowBatch, with the same attributes and methods as
+    a Row """
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def skip(self):
+        return bool(self.batch.skip[self.index])
+
+    @property
+    def rawLine(self):
+        return self.batch.rawLine[self.index]
+
+    @property
+    def timestamp(self):
+        if self.skip or self.batch.timestamp is None:
+            return None
+        return str(self.batch.timestamp[self.index])
+
+    @property
+    def date(self):
+        if self.skip or self.batch.timestamp is None:
+            return None
+        return str(self.batch.date[self.index])
+
+    @property
+    def time(self):
+        if self.skip or self.batch.timestamp is None:
+            return None
+        return str(self.batch.time[self.index])
+
+    @property
+    def val(self):
+        if self.batch.val is None:
+            return None
+        return self.batch.val[self.index]
+
+    def __str__(self):
+        """ String representation of row"""
+        return "{},{:.03f},{:.06f},{:.06f},{:.06f},{:.06f}".format(
+            self.timestamp, self.getEpoch(), self.val[0],
+            self.val[1], self.val[2], self.getTotAcc())
+
+    def getEpoch(self):
+        """ Get the timestamp as an epoch, seconds since 1/1/1970
+        """
+        if self.skip:
+            return None
+        return float(self.batch.epoch[self.index])
+
+    def getTotAcc(self):
+        """ Get total acceleration for the three x,y,z values.
+        """
+        if self.skip:
+            return None
+        return float(self.batch.tot[self.index])
@@ -50,6 +50,7 @@ from decimal import Decimal
 from math import modf, sqrt
 from os import path
 from scipy import signal
+from timeindex import open_times, parse_time_ms
 import numpy as np
 from tkinter import filedialog
 import argparse
@@ -122,6 +123,15 @@ class Row:
             self._totalAcc = sqrt(self._totalAcc)
         return self._totalAcc
 
+def localEpoch(milliseconds):
+    """ Convert milliseconds since the epoch from parse_time_ms() to an
+    epoch in local time, as Row.getEpoch() gives, or None if it is None
+    """
+    if milliseconds is None:
+        return None
+    dateObject = time.gmtime(milliseconds // 1000)[:8] + (-1,)
+    return time.mktime(dateObject) + (milliseconds % 1000) / 1000
+
 class OutputRow:
     """This represents a row in the output file """
 
@@ -202,7 +212,9 @@ class Averager:
                  cutoff=None,
                  verbose=False,
                  limit=None,
-                 version=False):
+                 version=False,
+                 start=None,
+                 end=None):
 
         if not path.exists(filename):
             print("File does not exist", file=sys.stderr)
@@ -219,8 +231,15 @@ class Averager:
         linesRead = 0
         outputRow = None
 
+        # Only the rows from time start up to time end are averaged,
+        # skipping to them with the time index of the file
+        startTime = parse_time_ms(start)
+        endTime = parse_time_ms(end)
+        startEpoch = localEpoch(startTime)
+        endEpoch = localEpoch(endTime)
+
         self._outputRows = []
-        with open(filename, "r") as self.fh:
+        with open_times(filename, startTime, endTime) as self.fh:
             line = self.fh.readline()
             while line:
                 row = Row(line)
@@ -232,6 +251,12 @@ class Averager:
                 if row.skip:
                     # Bad row
                     continue
+
+                if ((startEpoch is not None and row.getEpoch() < startEpoch) or
+                    (endEpoch is not None and row.getEpoch() >= endEpoch)):
+                    # Outside the range of times
+                    line = self.fh.readline()
+                    continue
                 
                 if outputRow is None:
                     # Starting a new output row
@@ -307,6 +332,8 @@ def main():
         verbose = False
         limit = None
         version = False
+        start = None
+        end = None
     else:
         parser = argparse.ArgumentParser(description=
                                          "Average down samples in CSV file")
@@ -324,11 +351,17 @@ def main():
         parser.add_argument("--config",
                             help="Configuration filename",
                             type=str)
+        parser.add_argument("--start",
+                            help="Only average samples from time START, YYYY-MM-DD HH:MM:SS")
+        parser.add_argument("--end",
+                            help="Only average samples before time END, YYYY-MM-DD HH:MM:SS")
         args = parser.parse_args()
         filePath = args.filename
         verbose = args.verbose
         limit = args.limit
         version = args.version
+        start = args.start
+        end = args.end
         if args.config is not None:
             configurationFile = args.config
 
@@ -343,7 +376,9 @@ def main():
                         cutoff=configuration["cutoff"],
                         verbose=verbose,
                         limit=limit,
-                        version=version)
+                        version=version,
+                        start=start,
+                        end=end)
 
     outputLines = averager()
 
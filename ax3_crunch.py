@@ -34,7 +34,6 @@
 # python3 ax3_crunch.py ../myDataFile.CWA
 # etc.
 
-from pathlib import Path
 import argparse
 import ax3_plot_minutes
 import ax3_seconds_stats
@@ -69,16 +68,11 @@ def process(file, configFile):
             return
         
 
-    # .cwa -> csv
-    outputFile, metadataFile = cwa.cwa(file, process=False)
-    # Generate output file if it doesn't exist
-    outputFilePath = Path(outputFile)
-    if not outputFilePath.is_file():
-        outputFile, metadataFile = cwa.cwa(file)
-        print(f"Output file is {outputFile}")
-        print(f"Metadata file is {metadataFile}")
-    else:
-        print(f"Not regenerating existing file {outputFile}")
+    # .cwa -> csv.  This only converts the sectors added since the
+    # last run, so re-downloading a growing file is cheap.
+    outputFile, metadataFile = cwa.cwa(file, incremental=True)
+    print(f"Output file is {outputFile}")
+    print(f"Metadata file is {metadataFile}")
     print()
 
     # Split the file
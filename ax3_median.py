@@ -34,12 +34,10 @@
 # X is the long axis
 # Y is the across-the-device axis
 # Z is across the thickness of the device axis
-from Row import Row
+from compression import open_output
+from loader import Loader
 from tkinter import filedialog
 import argparse
-import csv
-import math
-import numpy as np
 import os
 import sys
 import tkinter as tk
@@ -55,51 +53,19 @@ class MedianProcessor:
         print("Output file is", fullPath)
         return fullPath
 
-    def process(self, filename, window):
-        """ Process the file """
-        # Count number of lines in file to get array dimension
+    def process(self, filename, window, start=None, end=None, jobs=1):
+        """ Process the file, or just the part of it from time start up
+        to time end, reading it with jobs processes """
+        # Read in one pass, into arrays sized from an estimate of the
+        # number of lines which grow as needed
         print(f"Median window size is {window}")
-        print("Count lines in file")
-        count = 0
-        with open(filename, "rt", newline="\n") as fh:
-            line = fh.readline().strip()
-            while line:
-                row = Row(line)
-                if row.skip:
-                    pass
-                else:
-                    count += 1
-                if count % 1000000 == 0:
-                    print(f"{count} lines counted")
-                line = fh.readline().strip()
-
-        # Set initial values of array to match actual field length
-        timestamp = np.array(["YYYY-MM-DD HH:MM:SS.FFF" for _ in range(count)])
-        x = np.zeros((count,))
-        y = np.zeros((count,))
-        z = np.zeros((count,))
-
         print("Read file")
-        firstLine = None
-        with open(filename, "rt", newline="\n") as fh:
-            line = fh.readline().strip()
-            index = 0
-            while line:
-                row = Row(line)
-                if row.skip:
-                     pass
-                else:
-                    if firstLine is None:
-                         firstLine = row.timestamp
-                    timestamp[index] = row.timestamp
-                    x[index] = row.val[0]
-                    y[index] = row.val[1]
-                    z[index] = row.val[2]
-                    index += 1
-                if index % 1000000 == 0:
-                    print(f"{index} data lines read")
-
-                line = fh.readline().strip()
+        data = Loader(filename, epoch=False, start=start, end=end, jobs=jobs).load()
+        print(f"{len(data)} data lines read")
+        timestamp = data.timestamp
+        x = data.x
+        y = data.y
+        z = data.z
 
         print("Calculate x axis medians")
         medx = medianFilter(x, window, len(x)//50)
@@ -110,7 +76,9 @@ class MedianProcessor:
 
         outputFilename = self.makeOutFile(filename)
         lineEnd = "\r\n"
-        with open(outputFilename, "w") as outfile:
+        # Compressed in the same way as the input file, as the name
+        # has the same extension
+        with open_output(outputFilename) as outfile:
             outfile.write("datetime, x, y, z{}".format(lineEnd))
             for index in range(len(timestamp)):
                 outfile.write("{},{:.06f},{:.06f},{:.06f}{}".format(
@@ -125,16 +93,26 @@ def main():
         filePath = filedialog.askopenfilename(
             filetypes = [("Comma separated file (CSV) format",".csv")])
         window = 7
+        start = None
+        end = None
+        jobs = 1
     else:
         parser = argparse.ArgumentParser(description=
                                          "Convert accelerometer file to per second values")
         parser.add_argument("filename", help="Input filename")
         parser.add_argument("--window", help="Window size",
                             type=int, default="7")
+        parser.add_argument("--start", help="Only use samples from time START, YYYY-MM-DD HH:MM:SS")
+        parser.add_argument("--end", help="Only use samples before time END, YYYY-MM-DD HH:MM:SS")
+        parser.add_argument("--jobs", help="Number of processes to read the file with",
+                            type=int, default=1)
         args = parser.parse_args()
         filePath = args.filename
         name, extension =  os.path.splitext(filePath)
         window = args.window
+        start = args.start
+        end = args.end
+        jobs = args.jobs
 
         if window < 0:
             print(f"Bad value for window, {window}, using 25")
@@ -148,7 +126,7 @@ def main():
             os.exit(0)
 
     processor = MedianProcessor()
-    processor.process(filePath, window)
+    processor.process(filePath, window, start, end, jobs)
 
 if __name__ == "__main__":
     main()
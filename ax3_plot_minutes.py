@@ -29,6 +29,7 @@
 #
 # Plot stats from ax3
 #
+from compression import open_input
 from tkinter import filedialog
 import argparse
 import configparser
@@ -142,7 +143,8 @@ class PlotMinutes:
                 sys.exit(1)
 
         # Numpy CSV reader
-        data = np.genfromtxt(filename, delimiter=",")
+        with open_input(filename) as fh:
+            data = np.genfromtxt(fh, delimiter=",")
 
         # Baselined flag is in the last field of the CSV file.  Only look
         # at the first row since the value is the same throughout the file
@@ -34,7 +34,8 @@
 # X is the long axis
 # Y is the across-the-device axis
 # Z is the across-the-device axis
-from Row import Row
+from loader import Loader
+from timestamps import UTC
 from tkinter import filedialog
 import argparse
 import csv
@@ -55,55 +56,22 @@ class StatsProcessor:
         print("Output file is", fullPath)
         return fullPath
 
-    def __call__(self, filename):
-        """ Process the file """
+    def __call__(self, filename, tz=UTC, jobs=1):
+        """ Process the file, whose timestamps are in time zone tz,
+        reading it with jobs processes """
         print(f"ax3_seconds_stats.py processing {filename}")
-        # Count number of lines in file to get array dimension
-        print("Count lines in file")
-        count = 0
-        with open(filename, "rt", newline="\n") as self.fh:
-            line = self.fh.readline().strip()
-            while line:
-                row = Row(line)
-                if row.skip:
-                    pass
-                else:
-                    count += 1
-                if count % 1000000 == 0:
-                    print(f"{count} lines counted")
-                line = self.fh.readline().strip()
-
-        self.filename = filename
-        self.timestamp = np.array(["(empty)" for _ in range(count)])
-        self.epoch = np.zeros((count,))
-        self.x = np.zeros((count,))
-        self.y = np.zeros((count,))
-        self.z = np.zeros((count,))
-        self.tot = np.zeros((count,))
-
         print("Read file")
-        self.firstLine = None
-        with open(filename, "rt", newline="\n") as self.fh:
-            line = self.fh.readline().strip()
-            index = 0
-            while line:
-                row = Row(line)
-                if row.skip:
-                     pass
-                else:
-                    if self.firstLine is None:
-                         self.firstLine = row.timestamp
-                    self.timestamp[index] = row.timestamp
-                    self.epoch[index] = row.getEpoch()
-                    self.x[index] = row.val[0]
-                    self.y[index] = row.val[1]
-                    self.z[index] = row.val[2]
-                    self.tot[index] = row.getTotAcc()
-                    index += 1
-                if index % 1000000 == 0:
-                    print(f"{index} data lines read")
+        data = Loader(filename, tz=tz, jobs=jobs).load()
+        print(f"{len(data)} data lines read")
 
-                line = self.fh.readline().strip()
+        self.filename = filename
+        self.timestamp = data.timestamp
+        self.epoch = data.epoch
+        self.x = data.x
+        self.y = data.y
+        self.z = data.z
+        self.tot = data.tot()
+        self.firstLine = str(data.timestamp[0])
 
 class Seconds:
     """This class converts the accelerometer data read by the
@@ -308,11 +276,11 @@ def summarise(type, array):
         type = type + " "
     print(f"{type} -- n={array.size}, min={array.min():.2f}, "+
           f"max={array.max():.2f}, mean={array.mean():.2f}, "+
-          f"std dev={array.std():.2f}, peak to peak={array.ptp():.2f}")
+          f"std dev={array.std():.2f}, peak to peak={np.ptp(array):.2f}")
 
-def process(filePath, limit = 0.05, axis = 3):
+def process(filePath, limit = 0.05, axis = 3, tz = UTC, jobs = 1):
     processor = StatsProcessor()
-    datafile = processor(filePath)
+    datafile = processor(filePath, tz, jobs)
     print("---descriptive stats---")
     summarise("x", processor.x)
     summarise("y", processor.y)
@@ -341,14 +309,23 @@ def main():
             filetypes = [("Comma separated file (CSV) format",".csv")])
         axis = 3
         limit = 0.05
+        tz = UTC
+        jobs = 1
     else:
         parser = argparse.ArgumentParser(description=
                                          "Convert accelerometer file to per second values")
         parser.add_argument("filename", help="Input filename")
         parser.add_argument("--axis", help="Axis number", type=int, default="3")
         parser.add_argument("--limit", help="+/- limit, default is 5 (percent)", type=int, default="5")
+        parser.add_argument("--tz", help="Time zone of the timestamps: UTC, which cwa.py writes (the default), " +
+                            "local for the time zone of this machine, or a name such as Europe/London",
+                            default=UTC)
+        parser.add_argument("--jobs", help="Number of processes to read the file with",
+                            type=int, default=1)
         args = parser.parse_args()
         filePath = args.filename
+        tz = args.tz
+        jobs = args.jobs
         name, extension =  os.path.splitext(filePath)
         axis = args.axis
         limit = args.limit
@@ -362,7 +339,7 @@ def main():
             print("You need the .csv, not the .CWA", file=stderr)
             os.exit(0)
 
-    process(filePath, limit, axis)
+    process(filePath, limit, axis, tz, jobs)
 
 if __name__ == "__main__":
     main()
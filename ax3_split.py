@@ -40,16 +40,19 @@ import sys
 from tkinter import filedialog
 import tkinter as tk
 import csv
-from Row import Row
+from compression import open_output, split_compression
+from loader import Loader
 import os
 
 class Processor:
 
     def makeOutFile(self, filename, date):
-        """ Make output filename """
+        """ Make output filename, compressed in the same way as the
+        input file """
         path, name = os.path.split(filename)
+        name, compressionExtension = split_compression(name)
         prefix = os.path.splitext(name)[0]
-        newName = prefix + "_" + date + ".csv"
+        newName = prefix + "_" + date + ".csv" + compressionExtension
         fullPath = os.path.join(path, newName)
         print("Output file is", fullPath)
         return fullPath
@@ -59,22 +62,19 @@ class Processor:
         outfiles = []
         date = None
         outfile = None
-        with open(filename, "rt", newline="\n") as self.fh:
-            line = self.fh.readline().strip()
-            while line:
-                row = Row(line, True, True)
-                if row.skip:
-                    pass
-                else:
-                    if row.date != date:
-                        date = row.date
-                        outputFilename = self.makeOutFile(filename, date)
-                        outfiles.append(outputFilename)
-                        if outfile is not None:
-                            outfile.close()
-                        outfile = open(outputFilename, "w")
-                    outfile.write(row.rawLine + "\n")
-                line = self.fh.readline().strip()
+        for chunk in Loader(filename, epoch=False, keepLines=True):
+            dates = chunk.date()
+            # Start of each run of lines with the same date
+            starts = np.flatnonzero(dates[1:] != dates[:-1]) + 1
+            for start, end in zip([0] + starts.tolist(), starts.tolist() + [len(chunk)]):
+                if dates[start] != date:
+                    date = str(dates[start])
+                    outputFilename = self.makeOutFile(filename, date)
+                    outfiles.append(outputFilename)
+                    if outfile is not None:
+                        outfile.close()
+                    outfile = open_output(outputFilename)
+                outfile.write("\n".join(chunk.lines[start:end]) + "\n")
         if outfile is not None:
             outfile.close()
         return outfiles
@@ -40,91 +40,57 @@ import sys
 from tkinter import filedialog
 import tkinter as tk
 import csv
-from Row import Row
+from compression import open_output, split_compression
+from groupstats import GroupStream, RunningStats, floor_divide, group_by, grouped_stats
+from loader import Loader
+from timestamps import UTC
 import os
 
+# Lines of the file read at a time by StatsProcessor.stream().  Fewer
+# than the Loader reads by default, as only one chunk is kept
+STREAM_CHUNK_LINES = 100000
+
+# Thresholds of the magnitude of the acceleration counted for each axis
+THRESHOLDS = (8, 7, 6, 1)
+
+# Fields of the per-minute files.  Order of fields is MPRS
+MINUTES_HEADER = ["epoch", "minute", "size", "x mean", "x peak to peak", "x rms", "x std dev",
+                  "y mean", "y peak to peak", "y rms", "y std dev", "z mean",
+                  "z peak to peak", "z rms", "z std dev", "tot mean", "tot peak to peak",
+                  "tot rms", "tot std dev", "is baselined flag"]
+
 class StatsProcessor:
 
     def makeOutFile(self, filename, firstLine):
-        """ Make output filename """
+        """ Make output filename, compressed in the same way as the
+        input file """
         path = os.path.split(filename)[0]
         startDate = firstLine.split()[0]
-        newName = "accelerometer_" + startDate + ".csv"
+        newName = "accelerometer_" + startDate + ".csv" + split_compression(filename)[1]
         fullPath = os.path.join(path, newName)
         print("Output file is", fullPath)
         return fullPath
 
-    def __call__(self, filename):
-        """ Process the file """
-        # Count number of valid lines in file to get array dimension
-        count = 0
-        with open(filename, "rt", newline="\n") as self.fh:
-            line = self.fh.readline().strip()
-            while line:
-                row = Row(line, decode=False)
-                if row.skip:
-                    pass
-                else:
-                    count += 1
-                    if count % 1000000 == 0:
-                        print(f"{count} lines counted")
-                line = self.fh.readline().strip()
+    def __call__(self, filename, tz=UTC, start=None, end=None, jobs=1):
+        """ Process the file, whose timestamps are in time zone tz, or
+        just the part of it from time start up to time end, reading it
+        with jobs processes """
+        data = Loader(filename, tz=tz, start=start, end=end, jobs=jobs).load()
+        print(f"{len(data)} lines read")
 
         self.filename = filename
-        self.timestamp = np.array(["(empty)" for _ in range(count)])
-        self.epoch = np.zeros((count,))
-        self.x = np.zeros((count,))
-        self.y = np.zeros((count,))
-        self.z = np.zeros((count,))
-        self.tot = np.zeros((count,))
-        rowAbove8 = [0,0,0]
-        rowAbove7 = [0,0,0]
-        rowAbove6 = [0,0,0]
-        rowAbove1 = [0,0,0]
-
-        self.firstLine = None
-        with open(filename, "rt", newline="\n") as self.fh:
-            line = self.fh.readline().strip()
-            index = 0
-            while line:
-                row = Row(line)
-                if row.skip:
-                     pass
-                else:
-                    if self.firstLine is None:
-                         self.firstLine = row.timestamp
-                    self.timestamp[index] = row.timestamp
-                    self.epoch[index] = row.getEpoch()
-                    self.x[index] = row.val[0]
-                    self.y[index] = row.val[1]
-                    self.z[index] = row.val[2]
-                    self.tot[index] = row.getTotAcc()
-                    index += 1
-                    if index % 1000000 == 0:
-                        print(f"{index} lines read")
-
-                    for axis in range(len(row.val)):
-                        if abs(row.val[axis]) >= 8:
-                            rowAbove8[axis] = rowAbove8[axis] + 1
-                        if abs(row.val[axis]) >= 7:
-                            rowAbove7[axis] = rowAbove7[axis] + 1
-                        if abs(row.val[axis]) >= 6:
-                            rowAbove6[axis] = rowAbove6[axis] + 1
-                        if abs(row.val[axis]) >= 1:
-                            rowAbove1[axis] = rowAbove1[axis] + 1
-                line = self.fh.readline().strip()
-
-        for axis in range(len(row.val)):
-            # size of x is the same as y and z
-            proportion = rowAbove8[axis]/self.x.size
-            print(f"axis {axis}, +/-8 or more {rowAbove8[axis]} times")
-            print(f"axis {axis}, +/-7 or more {rowAbove7[axis]} times")
-            print(f"axis {axis}, +/-6 or more {rowAbove6[axis]} times")
-            print(f"axis {axis}, +/-1 or more {rowAbove1[axis]} times")
-        print()
+        self.timestamp = data.timestamp
+        self.epoch = data.epoch
+        self.x = data.x
+        self.y = data.y
+        self.z = data.z
+        self.tot = data.tot()
+        self.firstLine = str(data.timestamp[0])
+
+        self.printCounts(count_over_thresholds((self.x, self.y, self.z)))
 
         outputFilename = self.makeOutFile(filename, self.firstLine)
-        outfile = open(outputFilename, "w")
+        outfile = open_output(outputFilename)
         with outfile:
             writer = csv.writer(outfile)
             for index in range(self.epoch.size):
@@ -133,6 +99,61 @@ class StatsProcessor:
                                  self.tot[index]])
         return outputFilename
 
+    def stream(self, filename, tz=UTC, start=None, end=None, jobs=1):
+        """Process the file as __call__() does, and work out the per-minute
+        data with StreamMinutes, a chunk of the file at a time, so only
+        one chunk is in memory at once.  The summary statistics of x, y,
+        z and tot are left in self.summaries, as RunningStats objects.
+        Returns the output file, the minutes file and the baselined
+        minutes file.
+
+        """
+        self.filename = filename
+        self.summaries = [RunningStats() for column in range(4)]
+        counts = np.zeros((3, len(THRESHOLDS)), np.int64)
+        lines = 0
+        outfile = None
+        minutes = None
+        try:
+            for chunk in Loader(filename, chunkLines=STREAM_CHUNK_LINES, tz=tz,
+                                start=start, end=end, jobs=jobs):
+                if len(chunk) == 0:
+                    continue
+                columns = (chunk.x, chunk.y, chunk.z, chunk.tot())
+                if outfile is None:
+                    self.firstLine = str(chunk.timestamp[0])
+                    outputFilename = self.makeOutFile(filename, self.firstLine)
+                    outfile = open_output(outputFilename)
+                    writer = csv.writer(outfile)
+                    minutes = StreamMinutes(self, chunk.epoch[0])
+                lines += len(chunk)
+                counts += count_over_thresholds(columns[:3])
+                for summary, values in zip(self.summaries, columns):
+                    summary.add(values)
+                writer.writerows(zip(chunk.epoch.tolist(), *(values.tolist() for values in columns)))
+                minutes.add(chunk.epoch, columns)
+                lastEpoch = chunk.epoch[-1]
+            if minutes is None:
+                raise ValueError(f"No data in {filename}")
+            minutes.close(lastEpoch)
+        finally:
+            if outfile is not None:
+                outfile.close()
+            if minutes is not None:
+                minutes.abandon()
+        print(f"{lines} lines read")
+        self.printCounts(counts)
+        self.interval = minutes.interval
+        return [outputFilename, minutes.outputFilenames[0], minutes.outputFilenames[1]]
+
+    def printCounts(self, counts):
+        """ Output the number of times the magnitude of each axis is at
+        least each of THRESHOLDS """
+        for axis in range(3):
+            for threshold, count in zip(THRESHOLDS, counts[axis]):
+                print(f"axis {axis}, +/-{threshold} or more {count} times")
+        print()
+
     def subtractMeans(self):
         meanx = self.x.mean()
         meany = self.y.mean()
@@ -149,20 +170,24 @@ class Minutes:
     class into the per-minute data """
 
     def makeOutFile(self, processor, baseline):
-        """ Make output filename """
+        """ Make output filename, compressed in the same way as the
+        input file """
         path = os.path.split(processor.filename)[0]
         startDate = processor.firstLine.split()[0]
         newName = ""
         if baseline :
             newName = "baselined_"
-        newName = newName + "minutes_" + startDate + ".csv"
+        newName = (newName + "minutes_" + startDate + ".csv" +
+                   split_compression(processor.filename)[1])
         fullPath = os.path.join(path, newName)
         print("Output file is", fullPath)
         return fullPath
 
-    def __call__(self, processor, baseline):
-        """Process the data.  Processor is the StatsProcessor object,
-        baseline is True if each minute of data is to be baselined
+    def __call__(self, processor):
+        """Process the data, writing the per-minute file and the
+        baselined per-minute file, where the mean of each minute of data
+        is subtracted, in one pass.  Processor is the StatsProcessor
+        object.  Returns the names of the two files.
 
         """
         self.startMinute = self.toMinute(processor.epoch[0])
@@ -170,148 +195,182 @@ class Minutes:
         self.interval = int(self.endMinute - self.startMinute + 1)
         self.processor = processor
 
-        self.timestamp = np.array(["(empty)" for _ in range(self.interval)])
-        self.epoch = np.zeros((self.interval,))
-        self.size = np.zeros((self.interval,))
-        self.currentIndex = np.zeros((self.interval,))
-
-        self.x = []
-        self.y = []
-        self.z = []
-        self.tot = []
-        # This is just a check that all entries are filled
-        self.check = []
-
-        # Count the number of samples in each minute and accumulate that
-        # in an array which is going to be used to size the individual
-        # arrays for each minute
-        for index in range(0, processor.x.size):
-            minute = self.toMinute(processor.epoch[index]) - self.startMinute
-            self.size[minute] = self.size[minute] + 1
-
-        # Now create the numpy arrays for each minute with the correct size
-        for minute in range(self.interval):
-            self.x.append(np.zeros((int(self.size[minute]),)))
-            self.y.append(np.zeros((int(self.size[minute]),)))
-            self.z.append(np.zeros((int(self.size[minute]),)))
-            self.tot.append(np.zeros((int(self.size[minute]),)))
-            self.check.append(np.zeros((int(self.size[minute]),)))
-            
-        for index in range(processor.x.size):
-            minute = self.toMinute(processor.epoch[index]) - self.startMinute
-            if self.epoch[minute] == 0:
-                # Epoch time is the minute as epoch time
-                self.epoch[minute] = int(self.toMinute(processor.epoch[index]) * 60)
-            rowIndex = int(self.currentIndex[minute])
-            self.x[minute][rowIndex] = processor.x[index]
-            self.y[minute][rowIndex] = processor.y[index]
-            self.z[minute][rowIndex] = processor.z[index]
-            self.tot[minute][rowIndex] = processor.tot[index]
-            self.check[minute][rowIndex] = 1
-            self.currentIndex[minute] = rowIndex + 1
-
-        # This is a sanity check to make sure that all values in
-        # all minutes are filled in.  It should not output anything
-        for minute in range(self.interval):
-            for index in range(len(self.check[minute])):
-                if self.check[minute][index] != 1:
-                    print(f"Check index {index} at minute {minute}!!!")
-
-        # Baseline
-        if baseline:
-            for minute in range(self.interval):
-                xmean = self.x[minute].mean()
-                ymean = self.y[minute].mean()
-                zmean = self.z[minute].mean()
-                totmean = self.tot[minute].mean()
-
-                self.x[minute] = self.x[minute] - xmean
-                self.y[minute] = self.y[minute] - ymean
-                self.z[minute] = self.z[minute] - zmean
-                self.tot[minute] = self.tot[minute] - totmean
-                baselineVal = 1
-            else:
-                baselineVal = 0
-                
-        outputFilename = self.makeOutFile(processor, baseline)
-        outfile = open(outputFilename, "w")
-        with outfile:
-            writer = csv.writer(outfile)
-            noDataMinutes = []
-            # Order of fields is MPRS
-            writer.writerow(["epoch", "minute", "size", "x mean", "x peak to peak", "x rms", "x std dev",
-                             "y mean", "y peak to peak", "y rms", "y std dev", "z mean",
-                             "z peak to peak", "z rms", "z std dev", "tot mean", "tot peak to peak",
-                             "tot rms", "tot std dev", "is baselined flag"])
-
-            for minute in range(0, self.interval):
-                rmsx = np.sqrt(np.mean(np.square(self.x[minute])))
-                rmsy = np.sqrt(np.mean(np.square(self.y[minute])))
-                rmsz = np.sqrt(np.mean(np.square(self.z[minute])))
-                rmstot = np.sqrt(np.mean(np.square(self.tot[minute])))
-                baselineVal = 0
-                if baseline:
-                    baselineVal = 1
-                if self.x[minute].size == 0:
-                    noDataMinutes.append(minute)
-                else:
-                    # Order of fields is MPRS
-                    writer.writerow([self.epoch[minute],
-                                     minute,
-                                     self.x[minute].size,
-                                     self.x[minute].mean(),
-                                     self.x[minute].ptp(),
-                                     rmsx,
-                                     self.x[minute].std(),
-                                     self.y[minute].mean(),
-                                     self.y[minute].ptp(),
-                                     rmsy,
-                                     self.y[minute].std(),
-                                     self.z[minute].mean(),
-                                     self.z[minute].ptp(),
-                                     rmsz,
-                                     self.z[minute].std(),
-                                     self.tot[minute].mean(),
-                                     self.tot[minute].ptp(),
-                                     rmstot,
-                                     self.tot[minute].std(),
-                                     baselineVal])
+        # Group the samples by minute, keeping them in the same order in
+        # each minute
+        order, minutes, starts, counts = group_by(floor_divide(processor.epoch, 60))
+        columns = [values[order] for values in
+                   (processor.x, processor.y, processor.z, processor.tot)]
+        stats = minute_stats(columns, starts, counts)
+
+        outputFilenames = [self.makeOutFile(processor, baseline) for baseline in (False, True)]
+        with open_output(outputFilenames[0]) as outfile, \
+             open_output(outputFilenames[1]) as baselinedOutfile:
+            writers = [csv.writer(outfile), csv.writer(baselinedOutfile)]
+            for writer in writers:
+                writer.writerow(MINUTES_HEADER)
+            write_minutes(writers, minutes, self.startMinute, counts, stats)
+        noDataMinutes = np.setdiff1d(np.arange(self.interval),
+                                     minutes - self.startMinute).tolist()
         if len(noDataMinutes) != 0:
             print(f"No data for minutes {noDataMinutes}")
-        return outputFilename
+        return outputFilenames
 
     def toMinute(self, second):
         """ Convert epoch seconds to minutes """
         minute = second // 60
         return int(minute)
 
-def summarise(type, array):
-    """ Summarise array"""
+class StreamMinutes:
+    """Converts the accelerometer data into the per-minute data, and
+    the baselined per-minute data, as Minutes does, a chunk at a time as
+    StatsProcessor.stream() reads it.  Each minute is written as soon as
+    the samples of a later minute are read, and only the samples of the
+    latest minute are kept, so the samples must be in time order, except
+    within a minute.  The output is the same as that of Minutes.
+
+    """
+
+    def __init__(self, processor, firstEpoch):
+        """ Open the output files.  Processor is the StatsProcessor
+        object and firstEpoch the epoch time of the first sample """
+        self.startMinute = Minutes().toMinute(firstEpoch)
+        # Last minute written, as a minute number
+        self.lastMinute = -1
+        self.noDataMinutes = []
+        self.groups = GroupStream()
+        self.outputFilenames = []
+        self.outfiles = []
+        self.writers = []
+        for baseline in (False, True):
+            outputFilename = Minutes().makeOutFile(processor, baseline)
+            outfile = open_output(outputFilename)
+            self.outputFilenames.append(outputFilename)
+            self.outfiles.append(outfile)
+            writer = csv.writer(outfile)
+            writer.writerow(MINUTES_HEADER)
+            self.writers.append(writer)
+
+    def add(self, epoch, columns):
+        """ Add a chunk of samples, with epoch times epoch, and the list
+        of arrays x, y, z and tot """
+        try:
+            self._write(*self.groups.add(floor_divide(epoch, 60), columns))
+        except ValueError:
+            raise ValueError("Samples are not in time order, so the file " +
+                             "can't be streamed") from None
+
+    def close(self, lastEpoch):
+        """ Write the last minute, and close the output files.  LastEpoch
+        is the epoch time of the last sample """
+        self._write(*self.groups.close())
+        for outfile in self.outfiles:
+            outfile.close()
+        self.outfiles = []
+        self.interval = int(Minutes().toMinute(lastEpoch) - self.startMinute + 1)
+        noDataMinutes = [minute for minute in self.noDataMinutes if minute < self.interval]
+        if len(noDataMinutes) != 0:
+            print(f"No data for minutes {noDataMinutes}")
+
+    def abandon(self):
+        """ Close the output files, if close() hasn't been called """
+        for outfile in self.outfiles:
+            outfile.close()
+        self.outfiles = []
+
+    def _write(self, minutes, starts, counts, columns):
+        """ Write complete minutes, as given by GroupStream """
+        if minutes.size == 0:
+            return
+        numbers = minutes - self.startMinute
+        # Minutes with no samples since the last one written
+        self.noDataMinutes.extend(np.setdiff1d(np.arange(self.lastMinute + 1, numbers[-1]),
+                                               numbers).tolist())
+        self.lastMinute = max(self.lastMinute, int(numbers[-1]))
+        write_minutes(self.writers, minutes, self.startMinute, counts,
+                      minute_stats(columns, starts, counts))
+
+def minute_stats(columns, starts, counts):
+    """Mean, peak to peak, rms and standard deviation of each minute, for
+    each of columns, arrays of x, y, z and tot sorted by minute, with
+    the minutes starting at starts, and counts samples in each.
+
+    """
+    return [grouped_stats(values, starts, counts) for values in columns]
+
+def write_minutes(writers, minutes, startMinute, counts, stats):
+    """Write the rows for minutes, in minutes since the epoch, with
+    counts samples and the stats from minute_stats(), to writers, for
+    the per-minute file and the baselined per-minute file.  Minute
+    numbers are from startMinute.  Subtracting the mean of a minute
+    makes its mean 0 and its rms the same as its standard deviation,
+    and doesn't change its peak to peak or standard deviation, so the
+    baselined rows come from the same stats.
+
+    """
+    writer, baselinedWriter = writers
+    # Epoch time is the minute as epoch time
+    epochs = (minutes * 60).astype(np.float64).tolist()
+    counts = counts.tolist()
+    stats = [[values.tolist() for values in columnStats] for columnStats in stats]
+    for index, minute in enumerate((minutes - startMinute).tolist()):
+        row = [epochs[index], minute, counts[index]]
+        baselinedRow = list(row)
+        for mean, ptp, rms, std in stats:
+            # Order of fields is MPRS
+            row.extend([mean[index], ptp[index], rms[index], std[index]])
+            baselinedRow.extend([0.0, ptp[index], std[index], std[index]])
+        # Is baselined flag
+        row.append(0)
+        baselinedRow.append(1)
+        writer.writerow(row)
+        baselinedWriter.writerow(baselinedRow)
+
+def count_over_thresholds(axes):
+    """ Number of times the magnitude of each of axes, arrays x, y and
+    z, is at least each of THRESHOLDS """
+    counts = np.zeros((len(axes), len(THRESHOLDS)), np.int64)
+    for axis, values in enumerate(axes):
+        magnitude = np.abs(values)
+        for index, threshold in enumerate(THRESHOLDS):
+            counts[axis, index] = np.count_nonzero(magnitude >= threshold)
+    return counts
+
+def summarise(type, stats):
+    """ Summarise stats, a RunningStats object """
     print(f"{type}")
-    print(f"-- n={array.size},")
-    print(f"   min={array.min():.2f}")
-    print(f"   max={array.max():.2f}")
-    print(f"   mean={array.mean():.2f}")
-    print(f"   std dev={array.std():.2f}")
-    print(f"   peak to peak={array.ptp():.2f}")
-
-def stats(filePath):
-    """ Main processing function
+    print(f"-- n={stats.count},")
+    print(f"   min={stats.minimum:.2f}")
+    print(f"   max={stats.maximum:.2f}")
+    print(f"   mean={stats.mean:.2f}")
+    print(f"   std dev={stats.std():.2f}")
+    print(f"   peak to peak={stats.ptp():.2f}")
+
+def stats(filePath, tz=UTC, start=None, end=None, jobs=1, stream=False):
+    """Main processing function.  If stream is True, the file is
+    processed a chunk at a time, which uses much less memory for long
+    files, but its samples must be in time order.
+
     """
     processor = StatsProcessor()
-    datafile = processor(filePath)
+    if stream:
+        datafile, nonBaselinedFile, baselinedFile = processor.stream(filePath, tz, start,
+                                                                     end, jobs)
+        summaries = processor.summaries
+        interval = processor.interval
+    else:
+        datafile = processor(filePath, tz, start, end, jobs)
+        summaries = [RunningStats(values) for values in
+                     (processor.x, processor.y, processor.z, processor.tot)]
     print("---descriptive stats---")
-    summarise("x", processor.x);
-    summarise("y", processor.y);
-    summarise("z", processor.z);
-    summarise("total", processor.tot);
+    for type, summary in zip(("x", "y", "z", "total"), summaries):
+        summarise(type, summary)
     print()
 
-    minutes = Minutes()
-    # Run without baselining the minutes data
-    nonBaselinedFile = minutes(processor, False)
-    baselinedFile = minutes(processor, True)
-    print(f"Dataset is {minutes.interval} minutes long")
+    if not stream:
+        minutes = Minutes()
+        nonBaselinedFile, baselinedFile = minutes(processor)
+        interval = minutes.interval
+    print(f"Dataset is {interval} minutes long")
     return [ datafile, nonBaselinedFile, baselinedFile ]
     
 def main():
@@ -322,19 +381,38 @@ def main():
         root.withdraw()
         filePath = filedialog.askopenfilename(
             filetypes = [("Comma separated file (CSV) format",".csv")])
+        tz = UTC
+        start = None
+        end = None
+        jobs = 1
+        stream = False
     else:
         parser = argparse.ArgumentParser(description=
                                          "Descriptive statistics for accelerometer file")
         parser.add_argument("filename", help="Input filename")
+        parser.add_argument("--tz", help="Time zone of the timestamps: UTC, which cwa.py writes (the default), " +
+                            "local for the time zone of this machine, or a name such as Europe/London",
+                            default=UTC)
+        parser.add_argument("--start", help="Only use samples from time START, YYYY-MM-DD HH:MM:SS")
+        parser.add_argument("--end", help="Only use samples before time END, YYYY-MM-DD HH:MM:SS")
+        parser.add_argument("--jobs", help="Number of processes to read the file with",
+                            type=int, default=1)
+        parser.add_argument("--stream", help="Process the file a chunk at a time, to use less memory",
+                            action="store_true")
         args = parser.parse_args()
         filePath = args.filename
+        tz = args.tz
+        start = args.start
+        end = args.end
+        jobs = args.jobs
+        stream = args.stream
         name, extension =  os.path.splitext(filePath)
 
         if extension == ".CWA":
             print("You need the .csv, not the .CWA", file=stderr)
             os.exit(0)
 
-    datafile, nonBaselinedFile, baselinedFile = stats(filePath)
+    datafile, nonBaselinedFile, baselinedFile = stats(filePath, tz, start, end, jobs, stream)
     print()
     print("Raw data output file is", datafile)
     print("Minutes data output file is", nonBaselinedFile)
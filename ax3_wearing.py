@@ -42,7 +42,8 @@
 # Y is the across-the-device axis
 # Z is across the thickness of the device
 
-from Row import Row
+from loader import Loader
+from timestamps import UTC
 from tkinter import filedialog
 import argparse
 import csv
@@ -120,23 +121,23 @@ class Processor:
         plt.close()
 
 
-    def __call__(self, filename, threshold):
-        """ Process the file """
-        # Count number of seconds in the file
-        count = 0
+    def __call__(self, filename, threshold, tz=UTC, jobs=1):
+        """ Process the file, whose timestamps are in time zone tz,
+        reading it with jobs processes """
+        # Highest acceleration in each second of each chunk of the file
         firstEpoch = None
         lastEpoch = None
-        with open(filename, "rt", newline="\n") as self.fh:
-            line = self.fh.readline().strip()
-            while line:
-                row = Row(line)
-                if row.skip:
-                    pass
-                elif firstEpoch is None:
-                    firstEpoch = row.getEpoch()
-                line = self.fh.readline().strip()
-
-            lastEpoch = row.getEpoch()
+        chunkSeconds = []
+        chunkMaxAcc = []
+        for chunk in Loader(filename, tz=tz, jobs=jobs):
+            if firstEpoch is None:
+                firstEpoch = chunk.epoch[0]
+            lastEpoch = chunk.epoch[-1]
+            seconds, inverse = np.unique(chunk.epoch.astype(np.int64), return_inverse=True)
+            maxAcc = np.zeros(seconds.size)
+            np.maximum.at(maxAcc, inverse, chunk.tot())
+            chunkSeconds.append(seconds)
+            chunkMaxAcc.append(maxAcc)
         secondsInFile = int(lastEpoch) - int(firstEpoch) + 1
         days = round(secondsInFile / 86400, 1)
         print(f"File contains {days} days ({secondsInFile} seconds) worth of data")
@@ -145,21 +146,11 @@ class Processor:
         maxAccPerSecond = np.zeros(secondsInFile)
         firstSecondEpoch = int(firstEpoch)
 
-        # Now scan through the file and pick out the highest acceleration
-        # in each second
-        with open(filename, "rt", newline="\n") as self.fh:
-            line = self.fh.readline().strip()
-            while line:
-                row = Row(line)
-                if row.skip:
-                    pass
-                else:
-                    second = int(row.getEpoch()) - firstSecondEpoch
-                    epochTimestamps[second] = int(row.getEpoch())
-                    totalAcc = row.getTotAcc()
-                    if totalAcc > maxAccPerSecond[second]:
-                        maxAccPerSecond[second] = totalAcc
-                line = self.fh.readline().strip()
+        # Now pick out the highest acceleration in each second
+        for seconds, maxAcc in zip(chunkSeconds, chunkMaxAcc):
+            second = seconds - firstSecondEpoch
+            epochTimestamps[second] = seconds
+            np.maximum.at(maxAccPerSecond, second, maxAcc)
         print(f"Max per second accelerations extracted")
         aboveThresholdValues = np.copy(maxAccPerSecond)
         # Now scan through looking for movement above a threshold
@@ -210,6 +201,11 @@ def main():
     parser.add_argument("filename", help="Input filename")
     parser.add_argument("threshold", help="Threshold",  nargs="?",
                         type=float, default="1")
+    parser.add_argument("--tz", help="Time zone of the timestamps: UTC, which cwa.py writes (the default), " +
+                        "local for the time zone of this machine, or a name such as Europe/London",
+                        default=UTC)
+    parser.add_argument("--jobs", help="Number of processes to read the file with",
+                        type=int, default=1)
     args = parser.parse_args()
     filePath = args.filename
     name, extension =  os.path.splitext(filePath)
@@ -219,7 +215,7 @@ def main():
         os.exit(0)
 
     processor = Processor()
-    plotfile, datafile = processor(args.filename, args.threshold)
+    plotfile, datafile = processor(args.filename, args.threshold, args.tz, args.jobs)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+#
+# BSD 2-Clause License
+#
+# Copyright (c) 2020, Jason Leake
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Cache of the arrays parsed from the CSV files by loader.py, so that a
+# file read by several ax3_* tools, or by the same tool again, is only
+# parsed once.  The cache is a directory, .ax3_cache, next to the CSV
+# file, holding a directory for each CSV file with a .npy file for each
+# column, which is memory mapped when it is read, and key.json.  This
+# records the path, size and modification time of the CSV file, the
+# time zone the epoch times were worked out in, as given by
+# timestamps.TimestampParser.key(), and the version of the
+# cache format, and the entry is only used if they all still match.
+# When a cache directory holds more than SIZE_LIMIT bytes, the least
+# recently used entries in it are removed.
+#
+
+import json
+import numpy as np
+import os
+import shutil
+import sys
+from struct import pack
+
+# Name of the cache directory, in the directory of the CSV file
+CACHE_DIRECTORY = ".ax3_cache"
+
+# Version of the cache format
+VERSION = 2
+
+# Largest number of bytes to keep in a cache directory
+SIZE_LIMIT = 8 << 30
+
+# Columns stored, and their types.  The timestamps are stored as
+# bytes, which is a quarter of the size of a NumPy string.
+COLUMNS = (("timestamp", "|S23"), ("epoch", "<f8"), ("x", "<f8"), ("y", "<f8"),
+           ("z", "<f8"), ("tot", "<f8"))
+
+# Size of the .npy file header.  It is written again when the file is
+# closed, with the final number of rows, so it has a fixed size.  The
+# column output of cwa.py writes its .npy files in the same way.
+NPY_HEADER = 128
+
+# Name of the key file in an entry
+KEY_FILE = "key.json"
+
+def entry_directory(filename):
+    """ The cache entry directory for CSV file filename """
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, CACHE_DIRECTORY, name)
+
+def entry_key(filename, timezone):
+    """ Key which a cache entry for filename, with epoch times worked
+    out in time zone timezone, must have to be used """
+    status = os.stat(filename)
+    return {"path": os.path.abspath(filename),
+            "size": status.st_size,
+            "mtime": status.st_mtime_ns,
+            "timezone": timezone,
+            "version": VERSION}
+
+def read(filename, timezone):
+    """Return a dictionary of the columns cached for CSV file filename,
+    with epoch times worked out in time zone timezone,
+    memory mapped copy on write, so they can be changed in memory, or
+    None if there is no usable entry for it.
+
+    """
+    directory = entry_directory(filename)
+    keyFilename = os.path.join(directory, KEY_FILE)
+    try:
+        with open(keyFilename) as fh:
+            key = json.load(fh)
+        if key != entry_key(filename, timezone):
+            return None
+        columns = { name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="c")
+                    for name, dtype in COLUMNS }
+        # Record when the entry was last used, for evict()
+        os.utime(keyFilename)
+    except (OSError, ValueError):
+        return None
+    return columns
+
+def npy_header(dtype, rows):
+    """ .npy version 1.0 file header for a 1-D array of rows elements
+    of type dtype """
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(
+        dtype, rows)
+    header = header.ljust(NPY_HEADER - 11) + "\n"
+    return (np.lib.format.magic(1, 0) + pack("<H", len(header)) +
+            header.encode("latin1"))
+
+class Writer:
+    """Writes a cache entry for CSV file filename, with epoch times
+    worked out in time zone timezone, a chunk of rows at a time.  The
+    entry is written to a temporary directory, which replaces any
+    existing entry when it is closed, so a partly written entry is
+    never read.  If the cache can't be written, a message is output and
+    the rows are not cached.
+
+    """
+
+    def __init__(self, filename, timezone):
+        self.filename = filename
+        self.directory = entry_directory(filename)
+        self.temporary = f"{self.directory}.{os.getpid()}.tmp"
+        self.key = entry_key(filename, timezone)
+        self.rows = 0
+        self.files = []
+        try:
+            os.makedirs(self.temporary, exist_ok=True)
+            for name, dtype in COLUMNS:
+                columnFile = open(os.path.join(self.temporary, name + ".npy"), "wb")
+                self.files.append(columnFile)
+                columnFile.write(npy_header(dtype, 0))
+        except OSError as error:
+            self.abandon(error)
+
+    def write(self, chunk):
+        """ Add the rows of a loader.Chunk, which must have the epoch
+        times.  Timestamps not in the usual form can't be cached """
+        if not self.files:
+            return
+        if chunk.timestamp.dtype != np.dtype("U23"):
+            self.abandon()
+            return
+        columns = (chunk.timestamp, chunk.epoch, chunk.x, chunk.y, chunk.z, chunk.tot())
+        try:
+            for columnFile, column, (name, dtype) in zip(self.files, columns, COLUMNS):
+                columnFile.write(column.astype(dtype).tobytes())
+        except UnicodeEncodeError:
+            self.abandon()
+            return
+        except OSError as error:
+            self.abandon(error)
+            return
+        self.rows += len(chunk)
+
+    def close(self):
+        """ Finish the entry, and remove old entries if the cache is too
+        big """
+        if not self.files:
+            return
+        try:
+            for columnFile, (name, dtype) in zip(self.files, COLUMNS):
+                columnFile.seek(0)
+                columnFile.write(npy_header(dtype, self.rows))
+                columnFile.close()
+            self.files = []
+            with open(os.path.join(self.temporary, KEY_FILE), "w") as out:
+                json.dump(self.key, out, indent=2)
+                out.write("\n")
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.rename(self.temporary, self.directory)
+        except OSError as error:
+            self.abandon(error)
+            return
+        evict(os.path.dirname(self.directory), keep=self.directory)
+
+    def abandon(self, error=None):
+        """ Give up writing the entry, reporting error if there is one """
+        if error is not None:
+            print(f"Not caching {self.filename}: {error}", file=sys.stderr)
+        for columnFile in self.files:
+            columnFile.close()
+        self.files = []
+        shutil.rmtree(self.temporary, ignore_errors=True)
+
+def entry_size(directory):
+    """ Number of bytes in the files of a cache entry """
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+def evict(cacheDirectory, limit=SIZE_LIMIT, keep=None):
+    """Remove the least recently used entries from cacheDirectory until
+    it holds no more than limit bytes.  Entry directory keep is not
+    removed.
+
+    """
+    entries = []
+    for entry in os.scandir(cacheDirectory):
+        # Skip entries being written
+        if not entry.is_dir() or entry.name.endswith(".tmp"):
+            continue
+        try:
+            lastUsed = os.stat(os.path.join(entry.path, KEY_FILE)).st_mtime
+        except OSError:
+            lastUsed = 0
+        entries.append((lastUsed, entry.path, entry_size(entry.path)))
+    total = sum(size for lastUsed, path, size in entries)
+    for lastUsed, path, size in sorted(entries):
+        if total <= limit:
+            break
+        if path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
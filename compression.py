@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+#
+# BSD 2-Clause License
+#
+# Copyright (c) 2020, Jason Leake
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Transparent reading and writing of compressed text files.  A file
+# whose name ends in .gz is gzip compressed, and one ending in .zst is
+# Zstandard compressed, which needs the zstandard package.  Input files
+# are recognised by their contents, whatever they are called.  The
+# compression or decompression runs in a background thread, so that it
+# overlaps with the processing of the data.
+#
+# e.g.
+#
+# with open_input("data.csv.gz", newline="\n") as fh:
+#     line = fh.readline()
+#
+# with open_output("median_data.csv.gz") as out:
+#     out.write(line)
+#
+
+import gzip
+import io
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Filename extension for each type of compression
+EXTENSIONS = { "gzip": ".gz", "zstd": ".zst" }
+
+# Start of a file of each type of compression
+MAGIC = { "gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd" }
+
+# Size of the blocks of data handed to and from the background threads
+BLOCK_SIZE = 1 << 20
+
+def compression_of(filename):
+    """ The compression implied by the extension of filename, or None """
+    for compression, extension in EXTENSIONS.items():
+        if filename.endswith(extension):
+            return compression
+    return None
+
+def split_compression(filename):
+    """ Split filename into the name without the compression extension,
+    if it has one, and the extension, which may be empty """
+    compression = compression_of(filename)
+    if compression is None:
+        return filename, ""
+    extension = EXTENSIONS[compression]
+    return filename[:-len(extension)], extension
+
+def compressed_name(filename, compression):
+    """ filename with the extension for compression added, or filename
+    unchanged if compression is None """
+    if compression is None:
+        return filename
+    return filename + EXTENSIONS[compression]
+
+class WriterThread:
+    """Background thread which passes the items put() in a bounded
+    queue of depth items to write(), in order, so that the writes
+    overlap with producing the next item.  An error from write() is
+    raised by the next put() or check().
+
+    """
+
+    def __init__(self, write, depth):
+        self.write = write
+        self.queue = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # Carry on taking items after an error, so put() doesn't block
+            if self.error is None:
+                try:
+                    self.write(item)
+                except Exception as error:
+                    self.error = error
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, item):
+        """ Queue item to be written """
+        self.check()
+        self.queue.put(item)
+
+    def finish(self):
+        """ Wait for the queued items to be written, and stop the
+        thread.  Any error is left for check() """
+        self.queue.put(None)
+        self.thread.join()
+
+def put_unless_stopped(items, item, stop):
+    """Put item in queue items, waiting for room in it unless
+    threading.Event stop is set, as when the consumer has gone away.
+    Returns False if item was not queued.
+
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _need_zstandard():
+    if zstandard is None:
+        raise ImportError("The zstandard package is needed for .zst files")
+
+class _ThreadedWriter(io.RawIOBase):
+    """Raw binary stream which hands the data written to it to a
+    background thread, through a bounded queue, to be written to
+    fileobj, which compresses it.  An error from the thread is raised
+    by the next write() or close().
+
+    """
+
+    def __init__(self, fileobj, depth=4):
+        super().__init__()
+        self.fileobj = fileobj
+        self.writer = WriterThread(fileobj.write, depth)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.writer.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.writer.finish()
+        try:
+            self.fileobj.close()
+        finally:
+            super().close()
+        self.writer.check()
+
+class _ThreadedReader(io.RawIOBase):
+    """Raw binary stream whose data is read from fileobj, which
+    decompresses it, by a background thread, up to depth blocks ahead
+    of the reader.
+
+    """
+
+    def __init__(self, fileobj, depth=4):
+        super().__init__()
+        self.fileobj = fileobj
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        self.block = b""
+        self.offset = 0
+        self.finished = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        """ Queue item, unless the stream has been closed """
+        return put_unless_stopped(self.queue, item, self.stop)
+
+    def run(self):
+        try:
+            while True:
+                block = self.fileobj.read(BLOCK_SIZE)
+                if not self.put(block) or not block:
+                    return
+        except Exception as error:
+            self.put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.offset == len(self.block):
+            if self.finished:
+                return 0
+            item = self.queue.get()
+            if isinstance(item, Exception):
+                self.finished = True
+                raise item
+            if not item:
+                self.finished = True
+                return 0
+            self.block = item
+            self.offset = 0
+        size = min(len(buffer), len(self.block) - self.offset)
+        buffer[:size] = self.block[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+        self.stop.set()
+        self.thread.join()
+        try:
+            self.fileobj.close()
+        finally:
+            super().close()
+
+def detect_compression(filename):
+    """ The compression of filename, gzip or zstd, found from its
+    contents, or None if it is not compressed """
+    with open(filename, "rb") as fh:
+        start = fh.read(4)
+    for compression, magic in MAGIC.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+def open_input(filename, newline=None):
+    """Open filename as a text file for reading, decompressing it if it
+    is gzip or Zstandard compressed.  newline is as for open().
+
+    """
+    compression = detect_compression(filename)
+    if compression == "gzip":
+        fileobj = gzip.open(filename, "rb")
+    elif compression == "zstd":
+        _need_zstandard()
+        fileobj = zstandard.ZstdDecompressor().stream_reader(
+            open(filename, "rb"), read_across_frames=True)
+    else:
+        return open(filename, "rt", newline=newline)
+    return io.TextIOWrapper(io.BufferedReader(_ThreadedReader(fileobj), BLOCK_SIZE),
+                            newline=newline)
+
+def open_output(filename, compression=None, append=False, newline=None):
+    """Open filename as a text file for writing, or adding to the end of
+    if append is True.  The output is compressed with compression,
+    gzip or zstd, which by default is that implied by the extension of
+    filename.  newline is as for open().
+
+    """
+    if compression is None:
+        compression = compression_of(filename)
+    mode = "ab" if append else "wb"
+    if compression == "gzip":
+        fileobj = gzip.open(filename, mode, compresslevel=6)
+    elif compression == "zstd":
+        _need_zstandard()
+        # Zstandard compresses blocks in parallel on its own threads
+        fileobj = zstandard.ZstdCompressor(threads=-1).stream_writer(open(filename, mode))
+    elif compression is None:
+        return open(filename, "a" if append else "w", newline=newline)
+    else:
+        raise ValueError(f"Unknown compression {compression}")
+    return io.TextIOWrapper(io.BufferedWriter(_ThreadedWriter(fileobj), BLOCK_SIZE),
+                            newline=newline)
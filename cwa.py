@@ -53,14 +53,26 @@
 # - Add cwa function to make trivially callable from other Python modules
 #
 
+from cache import NPY_HEADER, npy_header
+from compression import (EXTENSIONS, WriterThread, compressed_name, compression_of,
+                         open_output, put_unless_stopped, split_compression)
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from math import floor
-from os import path
-from struct import pack, unpack
+from os import fstat, path, remove
+from struct import unpack
+from timestamps import local_hours, parse_time
 from tkinter import filedialog
 import argparse
-import io
+import hashlib
+import json
+import mmap
+import numpy as np
+import os
+import queue
+import shutil
 import sys
+import threading
 import time
 import tkinter as tk
 
@@ -73,6 +85,29 @@ def ushort(value):
 def short(value):
     return (value + 2 ** 15) % 2 ** 16 - 2 ** 15
 
+def unpack_packed(words):
+    """Unpack packed mode (4 bytes per sample) samples in bulk.  words
+    is an array of the 32-bit sample words.  Each word holds three
+    10-bit two's complement values and a shared 2-bit exponent, as
+    eezzzzzz zzzzyyyy yyyyyyxx xxxxxxxx.  Returns an int16 array with
+    the shape of words plus a final axis holding x, y and z.  This is
+    the array equivalent of
+
+    sample.x = short(short((ushort(65472) & ushort(temp << 6))) >> (6 - byte(temp >> 30)))
+
+    and the same for y and z with temp >> 4 and temp >> 14.
+
+    """
+    words = np.asarray(words, dtype=np.uint32)
+    # Each value is moved to the top 10 bits of a 16 bit word and then
+    # arithmetic shifted right, which sign extends it and applies the
+    # exponent at the same time
+    shift = (6 - (words >> 30)).astype(np.int16)
+    samples = np.empty(words.shape + (3,), dtype=np.int16)
+    for axis, value in enumerate((words << 6, words >> 4, words >> 14)):
+        samples[..., axis] = (value & 0xffc0).astype(np.uint16).view(np.int16) >> shift
+    return samples
+
 # Local "URL-decode as UTF-8 string" function
 def urldecode(input):
     output = bytearray()
@@ -116,6 +151,16 @@ class Parameters:
             self.linux = args.linux
             self.standardGravity = args.sg
             self.writeHeader = not args.noheader
+            self.start = parse_time(args.start)
+            self.end = parse_time(args.end)
+            self.jobs = args.jobs
+            self.outputFormat = args.format
+            self.incremental = args.incremental
+            self.aux = args.aux
+            self.resample = args.resample
+            self.interpolation = args.interpolation
+            self.index = args.index
+            self.compression = args.compress
         else:
             self.verbose = False
             self.limit = None
@@ -123,8 +168,21 @@ class Parameters:
             self.linux = False
             self.standardGravity = False
             self.writeHeader = True
+            self.start = None
+            self.end = None
+            self.jobs = 1
+            self.outputFormat = "csv"
+            self.incremental = False
+            self.aux = False
+            self.resample = None
+            self.interpolation = "linear"
+            self.index = False
+            self.compression = None
 
-    def set(self, verbose, limit, version, linux, sg, noheader):
+    def set(self, verbose, limit, version, linux, sg, noheader,
+            start=None, end=None, jobs=1, outputFormat="csv",
+            incremental=False, aux=False, resample=None, interpolation="linear",
+            index=False, compression=None):
         """ Set parameters to non-default values """
         self.verbose = verbose
         self.limit = limit
@@ -132,9 +190,602 @@ class Parameters:
         self.linux = linux
         self.standardGravity = sg
         self.writeHeader = not noheader 
+        self.start = parse_time(start)
+        self.end = parse_time(end)
+        self.jobs = jobs
+        self.outputFormat = outputFormat
+        self.incremental = incremental
+        self.aux = aux
+        self.resample = resample
+        self.interpolation = interpolation
+        self.index = index
+        self.compression = compression
+
+# Size of a CWA file sector.  The "MD" header occupies the first two
+# sectors and each "AX" data block occupies one sector.
+SECTOR_SIZE = 512
+
+# Number of sectors read and decoded in one go
+CHUNK_SECTORS = 4096
+
+# Layout of an "AX" data sector.  deviceId is really the fractional
+# part of the timestamp if its top bit is set.
+AX_SECTOR = np.dtype([("header", "S2"),
+                      ("packetLength", "<u2"),
+                      ("deviceId", "<u2"),
+                      ("sessionId", "<u4"),
+                      ("sequenceId", "<u4"),
+                      ("sampleTime", "<u4"),
+                      ("light", "<u2"),
+                      ("temperature", "<u2"),
+                      ("events", "u1"),
+                      ("battery", "u1"),
+                      ("sampleRate", "u1"),
+                      ("numAxesBPS", "u1"),
+                      ("timestampOffset", "<i2"),
+                      ("sampleCount", "<u2"),
+                      ("sampleData", "u1", (480,)),
+                      ("checksum", "<u2")])
+
+# Default number of samples in a chunk from CWA.iter_chunks()
+CHUNK_SAMPLES = 1000000
+
+# Maximum number of samples in a sector for 6 and 4 bytes per sample
+MAX_SAMPLES = { 6: 480 // 6, 4: 480 // 4 }
+
+# Status of a sector in the sector index, from CWA.sector_status(),
+# which is an index into this.  The checks are made in this order.
+SECTOR_STATUS = ("valid",
+                 "not a data sector",
+                 "packet length is not 508",
+                 "sample time is undefined",
+                 "bad checksum",
+                 "bad session ID",
+                 "unsupported sample format")
+
+# An entry of the sector index, CWA.sector_index().  offset is the
+# position of the sector in the file, time is its timestamp, in the
+# same form as the sample times, or NaN, rate is the nominal sample
+# rate in Hz and status is an index into SECTOR_STATUS.
+SECTOR_INDEX = np.dtype([("offset", "<u8"),
+                         ("sequenceId", "<u4"),
+                         ("time", "<f8"),
+                         ("sampleCount", "<u2"),
+                         ("rate", "<f4"),
+                         ("status", "u1")])
+
+def sector_checksums(sectors):
+    """Checksum a run of sectors, an AX_SECTOR array, in one go.
+    Returns the 16 bit sum of the 256 words in each sector, which is
+    zero for a sector that is intact.
+
+    """
+    words = np.ascontiguousarray(sectors).view("<u2").reshape(-1, SECTOR_SIZE // 2)
+    return words.sum(axis=1, dtype=np.uint16)
+
+def format_timestamp(sampleTime):
+    """ Format a sample time, in seconds since the epoch, the way that
+    the output file represents it """
+    tStr = "{:.5f}".format(sampleTime)
+
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(int(floor(sampleTime))))
+    fractionTimestamp = tStr.split(".",1)[1]
+
+    # Convert 10 us units to ms units
+    fractionTimestamp = float(fractionTimestamp) / 100
+    # Integer number of ms
+    fractionTimestamp = int(fractionTimestamp)
+    fractionTimestamp = str(fractionTimestamp)
+    # Pad to three digits.  It is after decimal point so add
+    # digits to left. e.g. if it is 10 ms, then this would
+    # be represented as 010 after the decimal point, i.e.
+    # 0.010
+    while len(fractionTimestamp) < 3:
+        fractionTimestamp = "0" + fractionTimestamp
+    return "{}.{}".format(timestamp, fractionTimestamp)
+
+def split_times(sampleTimes):
+    """Split an array of sample times, in seconds since the epoch, into
+    whole seconds and milliseconds in the same way as format_timestamp().
+    The milliseconds are the first three of the five decimal places the
+    time is rounded to, so they are truncated, and the seconds are the
+    time rounded down, even if the rounding took the fractional part up
+    to 1.  Returns two int64 arrays.
+
+    """
+    seconds = np.floor(sampleTimes)
+    # The fractional part is exact, and the rounding error of scaling it
+    # is far smaller than the spacing of its possible values, so this
+    # rounds the same way as "{:.5f}"
+    fraction = np.rint((sampleTimes - seconds) * 100000).astype(np.int64) % 100000
+    return seconds.astype(np.int64), fraction // 100
+
+class TimestampFormatter:
+    """Formats blocks of sample times, in seconds since the epoch, as
+    the timestamps in the output file, "YYYY-MM-DD HH:MM:SS.fff".  The
+    date and time part is formatted once per second and cached, and the
+    millisecond part comes from a table.
+
+    """
+
+    MILLISECONDS = [".{:03d}".format(ms) for ms in range(1000)]
+
+    def __init__(self):
+        self._prefixes = dict()
+
+    def __call__(self, sampleTimes):
+        """ Returns a list of the formatted timestamps """
+        seconds, milliseconds = split_times(sampleTimes)
+        uniqueSeconds, inverse = np.unique(seconds, return_inverse=True)
+        prefixes = []
+        for second in uniqueSeconds.tolist():
+            prefix = self._prefixes.get(second)
+            if prefix is None:
+                if len(self._prefixes) > 100000:
+                    self._prefixes.clear()
+                prefix = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(second))
+                self._prefixes[second] = prefix
+            prefixes.append(prefix)
+        return [prefixes[index] + self.MILLISECONDS[ms]
+                for index, ms in zip(inverse.ravel().tolist(), milliseconds.tolist())]
+
+class CWA_Chunk:
+    """A chunk of decoded samples, as arrays.  time is the sample times
+    in seconds since the epoch, values is an N x 3 array of the x, y
+    and z values, also available as x, y and z, and light, temperature
+    and battery are the raw readings of the sector each sample came
+    from.  sectorStart is True for the first sample of each sector.
+
+    """
+
+    FIELDS = ("time", "values", "light", "temperature", "battery", "sectorStart")
 
-class CWA_Sample:
-    pass
+    def __init__(self, time, values, light, temperature, battery, sectorStart):
+        self.time = time
+        self.values = values
+        self.x = values[:, 0]
+        self.y = values[:, 1]
+        self.z = values[:, 2]
+        self.light = light
+        self.temperature = temperature
+        self.battery = battery
+        self.sectorStart = sectorStart
+
+    def __len__(self):
+        return len(self.time)
+
+    def select(self, selection):
+        """ New chunk holding the samples selected by selection, a
+        slice or a boolean mask """
+        return CWA_Chunk(*[getattr(self, name)[selection] for name in self.FIELDS])
+
+    def scaled(self, factor):
+        """ New chunk with values multiplied by factor """
+        return CWA_Chunk(self.time, self.values * factor,
+                         self.light, self.temperature, self.battery, self.sectorStart)
+
+    def aux(self):
+        """Light, temperature and battery readings of the sectors which
+        start in this chunk, in physical units.  Returns arrays of the
+        time of the first sample of each sector, the light in lux, the
+        temperature in degrees C and the battery voltage.
+
+        """
+        sectorStart = self.sectorStart
+        light = (self.light[sectorStart] & 0x3ff).astype(np.float64)
+        temperature = (self.temperature[sectorStart] & 0x3ff).astype(np.float64)
+        battery = self.battery[sectorStart].astype(np.float64)
+        return (self.time[sectorStart],
+                10 ** (light / 341),
+                temperature * 75 / 256 - 50,
+                (battery + 512) * 6000 / 1024 / 1000)
+
+    @staticmethod
+    def concatenate(chunks):
+        """ Join a list of chunks into one """
+        return CWA_Chunk(*[np.concatenate([getattr(chunk, name) for chunk in chunks])
+                           for name in CWA_Chunk.FIELDS])
+
+class Resampler:
+    """Resamples a stream of CWA_Chunks onto a grid of exact times,
+    multiples of 1/rate seconds since the epoch, by linear or cubic
+    (Hermite, with tangents from the neighbouring samples)
+    interpolation.  Call it with each chunk in turn to get a chunk of
+    the resampled values for the grid times it can now fill in; a few
+    samples are kept from one chunk to the next so that the
+    interpolation runs across the boundaries.  Call close() at the end
+    of the samples to get the values for the intervals still kept.  No
+    values are produced in gaps of more than MAX_GAP seconds between
+    samples.  The light,
+    temperature and battery readings are those of the sample before
+    each grid time, and sectorStart is always False.
+
+    """
+
+    METHODS = ("linear", "cubic")
+
+    # Longest time between two samples to interpolate across, seconds
+    MAX_GAP = 0.5
+
+    def __init__(self, rate, method="linear"):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown interpolation method {method}")
+        self.rate = rate
+        self.cubic = method == "cubic"
+        # Samples needed before and after the start of an interval
+        # between samples to interpolate in it
+        self.before = 1 if self.cubic else 0
+        self.after = 2 if self.cubic else 1
+        self.pending = None
+        # Index in pending of the next interval to interpolate in
+        self.next = 0
+
+    def ready(self):
+        """ True if enough samples have been seen that the output no
+        longer depends on those before them """
+        return self.pending is not None and len(self.pending) >= self.before + self.after
+
+    def __call__(self, chunk):
+        if self.pending is not None:
+            chunk = CWA_Chunk.concatenate([self.pending, chunk])
+        # Interpolated timestamps can step back slightly between
+        # sectors, so drop samples which don't advance the time
+        sampleTime = chunk.time
+        previous = np.maximum.accumulate(np.concatenate(([-np.inf], sampleTime[:-1])))
+        if not (sampleTime > previous).all():
+            chunk = chunk.select(sampleTime > previous)
+            sampleTime = chunk.time
+
+        # Intervals next up to end - 1 can be interpolated in
+        end = len(chunk) - self.after
+        if end > self.next:
+            output = self.interpolate(chunk, self.next, end)
+            self.next = end
+        else:
+            output = None
+        keep = max(0, self.next - self.before)
+        self.pending = chunk.select(slice(keep, None))
+        self.next -= keep
+        if output is None:
+            return chunk.select(slice(0, 0))
+        return output
+
+    def close(self):
+        """Resampled chunk for the intervals at the end of the samples,
+        which __call__() keeps until it has the samples after them, or
+        None if there are none.  For cubic interpolation, the tangent at
+        the last sample is the slope of the interval before it, as at a
+        gap.
+
+        """
+        chunk = self.pending
+        self.pending = None
+        next, self.next = self.next, 0
+        if chunk is None or len(chunk) - 1 <= next:
+            return None
+        return self.interpolate(chunk, next, len(chunk) - 1)
+
+    def interpolate(self, chunk, first, end):
+        """ Resampled chunk for the grid times in the intervals between
+        samples first up to end - 1 and the sample after each """
+        sampleTime = chunk.time
+        rate = self.rate
+        # Grid times from sampleTime[first] up to sampleTime[end]
+        startIndex = int(np.ceil(sampleTime[first] * rate))
+        while startIndex / rate < sampleTime[first]:
+            startIndex += 1
+        while (startIndex - 1) / rate >= sampleTime[first]:
+            startIndex -= 1
+        endIndex = int(np.ceil(sampleTime[end] * rate))
+        while endIndex / rate < sampleTime[end]:
+            endIndex += 1
+        while (endIndex - 1) / rate >= sampleTime[end]:
+            endIndex -= 1
+        gridTime = np.arange(startIndex, max(startIndex, endIndex)) / rate
+        interval = np.searchsorted(sampleTime, gridTime, side="right") - 1
+        gap = np.diff(sampleTime) > self.MAX_GAP
+        inData = ~gap[interval]
+        gridTime = gridTime[inData]
+        interval = interval[inData]
+
+        values = chunk.values
+        step = sampleTime[interval + 1] - sampleTime[interval]
+        fraction = ((gridTime - sampleTime[interval]) / step)[:, np.newaxis]
+        if self.cubic:
+            slope = self.slopes(sampleTime, values)
+            fraction2 = fraction * fraction
+            fraction3 = fraction2 * fraction
+            step = step[:, np.newaxis]
+            resampled = ((2 * fraction3 - 3 * fraction2 + 1) * values[interval] +
+                         (fraction3 - 2 * fraction2 + fraction) * step * slope[interval] +
+                         (3 * fraction2 - 2 * fraction3) * values[interval + 1] +
+                         (fraction3 - fraction2) * step * slope[interval + 1])
+        else:
+            resampled = values[interval] + fraction * (values[interval + 1] - values[interval])
+        return CWA_Chunk(gridTime, resampled, chunk.light[interval],
+                         chunk.temperature[interval], chunk.battery[interval],
+                         np.zeros(gridTime.shape, dtype=bool))
+
+    def slopes(self, sampleTime, values):
+        """ Tangents at each sample, from the samples either side of it,
+        or on one side at the ends and gaps """
+        step = np.diff(sampleTime)[:, np.newaxis]
+        difference = np.diff(values, axis=0) / step
+        usable = step <= self.MAX_GAP
+        # Slope of the interval before and after each sample, where usable
+        before = np.concatenate((np.zeros((1, 1), dtype=bool), usable))
+        after = np.concatenate((usable, np.zeros((1, 1), dtype=bool)))
+        zero = np.zeros((1, values.shape[1]))
+        slopeBefore = np.concatenate((zero, difference))
+        slopeAfter = np.concatenate((difference, zero))
+        slope = np.where(after, slopeAfter, np.where(before, slopeBefore, 0))
+        both = (before & after)[:, 0]
+        if both.any():
+            central = np.flatnonzero(both)
+            slope[central] = ((values[central + 1] - values[central - 1]) /
+                              (sampleTime[central + 1] - sampleTime[central - 1])[:, np.newaxis])
+        return slope
+
+class CsvOutput:
+    """ Writes converted samples to the CSV output file """
+
+    HEADING = "datetime, x, y, z"
+
+    def __init__(self, filename, parameters, header=True, append=False):
+        """filename is the output file.  header is False to never write
+        the heading line, as for a part of a file.  append is True to
+        add to the end of an existing file.
+
+        """
+        if parameters.linux:
+            self.lineEnd = "\n"
+        else:
+            self.lineEnd = "\r\n"
+        self.formatter = TimestampFormatter()
+        # Compressed if filename ends in .gz or .zst
+        self.out = open_output(filename, append=append)
+        if header and parameters.writeHeader and not append:
+            self.out.write("{}{}".format(self.HEADING, self.lineEnd))
+
+    def format(self, chunk):
+        """ The lines of output for a CWA_Chunk of samples, as a string """
+        lineEnd = self.lineEnd
+        return "".join(["{},{:.06f},{:.06f},{:.06f}{}".format(
+            timestamp, x, y, z, lineEnd)
+                        for timestamp, (x, y, z) in zip(self.formatter(chunk.time),
+                                                        chunk.values.tolist())])
+
+    def write_formatted(self, text):
+        """ Write the output from format() """
+        self.out.write(text)
+
+    def write(self, chunk):
+        """ Write a CWA_Chunk of samples """
+        self.write_formatted(self.format(chunk))
+
+    def append(self, partFilename):
+        """ Append a part of the output written by another CsvOutput """
+        self.out.flush()
+        with open(partFilename, 'rb') as part:
+            shutil.copyfileobj(part, self.out.buffer)
+
+    def close(self, cwa=None):
+        self.out.close()
+
+class AuxOutput(CsvOutput):
+    """Writes the light, temperature and battery readings of each
+    sector, in lux, degrees C and volts, to a CSV file, with the time
+    of the first sample of the sector.
+
+    """
+
+    HEADING = "datetime, light, temperature, battery"
+
+    def format(self, chunk):
+        """ The lines of output for the sectors which start in a
+        CWA_Chunk, as a string """
+        lineEnd = self.lineEnd
+        sampleTime, light, temperature, battery = chunk.aux()
+        return "".join(["{},{:.2f},{:.2f},{:.3f}{}".format(
+            timestamp, lux, celsius, volts, lineEnd)
+                        for timestamp, lux, celsius, volts in zip(
+                                self.formatter(sampleTime), light.tolist(),
+                                temperature.tolist(), battery.tolist())])
+
+class ColumnOutput:
+    """Writes converted samples in a binary columnar format, which is
+    much smaller than the CSV file and can be loaded, or memory mapped,
+    with load_columns() or numpy.load().  The output is a directory
+    holding a .npy file for each column and header.json, which
+    describes them.  The time column is in integer milliseconds since
+    the epoch, matching the CSV timestamps, and the x, y and z columns
+    are float32.
+
+    """
+
+    COLUMNS = (("time", "<i8"), ("x", "<f4"), ("y", "<f4"), ("z", "<f4"))
+
+    def __init__(self, directory, parameters, header=True, append=False):
+        """directory is the output directory.  append is True to add
+        rows to the end of existing column files.
+
+        """
+        self.directory = directory
+        self.standardGravity = parameters.standardGravity
+        self.resample = parameters.resample
+        self.rows = 0
+        # Sample rate in the header of the output being appended to
+        self.appendedRate = None
+        if append:
+            try:
+                with open(path.join(directory, "header.json")) as fh:
+                    self.appendedRate = json.load(fh).get("sampleRate")
+            except (OSError, ValueError):
+                pass
+        os.makedirs(directory, exist_ok=True)
+        self.files = []
+        for name, dtype in self.COLUMNS:
+            columnFilename = path.join(directory, name + ".npy")
+            if append:
+                self.rows = np.load(columnFilename, mmap_mode='r').size
+                columnFile = open(columnFilename, 'r+b')
+                # Drop anything after the rows in the header
+                columnFile.seek(NPY_HEADER + self.rows * np.dtype(dtype).itemsize)
+                columnFile.truncate()
+            else:
+                columnFile = open(columnFilename, 'wb')
+                columnFile.write(npy_header(dtype, 0))
+            self.files.append(columnFile)
+
+    def format(self, chunk):
+        """ The data to add to each column file for a CWA_Chunk of
+        samples, as a list of bytes """
+        seconds, milliseconds = split_times(chunk.time)
+        columns = [seconds * 1000 + milliseconds, chunk.x, chunk.y, chunk.z]
+        return [column.astype(dtype).tobytes()
+                for column, (name, dtype) in zip(columns, self.COLUMNS)]
+
+    def write_formatted(self, data):
+        """ Write the output from format() """
+        for columnFile, columnData in zip(self.files, data):
+            columnFile.write(columnData)
+        self.rows += len(data[0]) // np.dtype(self.COLUMNS[0][1]).itemsize
+
+    def write(self, chunk):
+        """ Write a CWA_Chunk of samples """
+        self.write_formatted(self.format(chunk))
+
+    def append(self, partDirectory):
+        """ Append a part of the output written by another ColumnOutput """
+        for columnFile, (name, dtype) in zip(self.files, self.COLUMNS):
+            column = np.load(path.join(partDirectory, name + ".npy"), mmap_mode='r')
+            for start in range(0, column.size, 1 << 20):
+                columnFile.write(column[start:start + (1 << 20)].tobytes())
+        self.rows += column.size
+
+    def close(self, cwa=None):
+        """Write the final .npy headers and header.json.  cwa is the CWA
+        object that converted the data, for the header, or None for a
+        part of the output.
+
+        """
+        for columnFile, (name, dtype) in zip(self.files, self.COLUMNS):
+            columnFile.seek(0)
+            columnFile.write(npy_header(dtype, self.rows))
+            columnFile.close()
+        if cwa is None:
+            return
+        units = "m/s^2" if self.standardGravity else "g"
+        if self.resample is not None:
+            sampleRate = self.resample
+        else:
+            sampleRate = cwa.nominal_rate()
+            if sampleRate is None:
+                sampleRate = self.appendedRate
+        header = {"format": "cwa.py columns",
+                  "version": 1,
+                  "source": cwa._filename,
+                  "deviceId": getattr(cwa, "deviceId", None),
+                  "sessionId": getattr(cwa, "sessionId", None),
+                  "sampleRate": sampleRate,
+                  "rows": self.rows,
+                  "columns": {"time": {"file": "time.npy", "dtype": "<i8",
+                                       "units": "ms since 1970-01-01 00:00:00, "
+                                       "as the CSV timestamps"},
+                              "x": {"file": "x.npy", "dtype": "<f4", "units": units},
+                              "y": {"file": "y.npy", "dtype": "<f4", "units": units},
+                              "z": {"file": "z.npy", "dtype": "<f4", "units": units}}}
+        with open(path.join(self.directory, "header.json"), "w") as out:
+            json.dump(header, out, indent=2)
+            out.write("\n")
+
+class ThreadedOutput:
+    """Wraps an output, such as a CsvOutput, so that the data formatted
+    by its format() method is written by a background thread, which
+    takes it from a bounded queue.  This lets the file writes overlap
+    with decoding and formatting the next chunk.  An error from a write
+    is raised by the next write() or close().
+
+    """
+
+    def __init__(self, output, depth=2):
+        self.output = output
+        self.writer = WriterThread(output.write_formatted, depth)
+
+    def write(self, chunk):
+        """ Format a CWA_Chunk and queue it to be written """
+        self.writer.put(self.output.format(chunk))
+
+    def close(self, cwa=None):
+        """ Wait for the queued data to be written, then close the
+        output.  If a write failed, the output is closed as a part, with
+        no cwa, and the error is raised """
+        self.writer.finish()
+        if self.writer.error is not None:
+            self.output.close()
+        self.writer.check()
+        self.output.close(cwa)
+
+def prefetch(iterable, depth=2):
+    """Generator yielding the items of iterable, which are produced by a
+    background thread, up to depth items ahead of the consumer.  An
+    exception from iterable is raised by the generator.
+
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    finished = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put_unless_stopped(items, (item, None), stop):
+                    return
+            put_unless_stopped(items, (finished, None), stop)
+        except Exception as error:
+            put_unless_stopped(items, (finished, error), stop)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+# Output classes for the --format option
+OUTPUT_FORMATS = { "csv": CsvOutput, "columns": ColumnOutput }
+
+def output_size(filename):
+    """Size in bytes of the output file, or of the column files in the
+    output directory, or None if there isn't one
+
+    """
+    if path.isdir(filename):
+        return sum(path.getsize(path.join(filename, name))
+                   for name in sorted(os.listdir(filename)) if name.endswith(".npy"))
+    if path.isfile(filename):
+        return path.getsize(filename)
+    return None
+
+def load_columns(directory, mmap_mode='r'):
+    """Load the output of ColumnOutput.  Returns the header, as a
+    dictionary, and a dictionary of the column arrays, which are memory
+    mapped unless mmap_mode is None.
+
+    """
+    with open(path.join(directory, "header.json")) as fh:
+        header = json.load(fh)
+    columns = dict()
+    for name, column in header["columns"].items():
+        columns[name] = np.load(path.join(directory, column["file"]), mmap_mode=mmap_mode)
+    return header, columns
 
 class CWA:
 
@@ -142,26 +793,39 @@ class CWA:
     # devices other than AX3
     isAnAx3 = True
     STANDARD_GRAVITY = 9.80665 # m/s^2, i.e. 58966 furlongs/fortnight^2
+    # Version of the incremental conversion state file
+    STATE_VERSION = 1
     
-    def __init__(self, filename):
-        """ Parameters: filename - input filename
+    def __init__(self, filename, outputFormat="csv", compression=None):
+        """ Parameters: filename - input filename, outputFormat - csv
+        for a CSV file or columns for ColumnOutput, compression - None,
+        gzip or zstd to compress the CSV files
         """
         self._filename = filename
-        self.outputFilename = path.splitext(self._filename)[0] + ".csv"
+        self.outputFormat = outputFormat
+        if outputFormat == "columns":
+            self.outputFilename = path.splitext(self._filename)[0] + "_columns"
+        else:
+            self.outputFilename = compressed_name(path.splitext(self._filename)[0] + ".csv",
+                                                  compression)
         self.metadataFilename = path.splitext(self._filename)[0] + "_metadata.txt"
+        # Light, temperature and battery readings, with --aux
+        self.auxFilename = compressed_name(path.splitext(self._filename)[0] + "_aux.csv",
+                                           compression)
+        # Sector index and gap report, with --index
+        self.indexFilename = path.splitext(self._filename)[0] + "_sectors.npy"
+        self.gapsFilename = path.splitext(self._filename)[0] + "_gaps.txt"
+        # Sidecar file for incremental conversion
+        self.stateFilename = (path.splitext(split_compression(self.outputFilename)[0])[0] +
+                              "_state.json")
 
     def __call__(self, parameters):
 
-        if parameters.linux:
-            lineEnd = "\n"
-        else:
-            lineEnd = "\r\n"
-            
         if parameters.version:
             # My versions contain my github username to avoid
             # clashes, in case OpenMovement start producing their
             # own version numbering scheme
-            print("cwa.py, version Isopleth 1.03")
+            print("cwa.py, version Isopleth 1.04")
 
         linesGenerated = 0
         if len(self._filename) == 0:
@@ -174,177 +838,778 @@ class CWA:
             print("File does not exist", file=sys.stderr)
             return linesGenerated
 
-        lastSequenceId = None
-        lastTimestampOffset = None
-        lastTimestamp = None
-
-        with open(self.outputFilename, 'w') as out:
-            if parameters.writeHeader:
-                out.write("datetime, x, y, z{}".format(lineEnd))
-            
-            with open(self._filename, 'rb') as self.fh:
-                header = self.fh.read(2).decode("ISO-8859-1")
-                while len(header) == 2:
-                    if parameters.verbose:
-                        print("Section header is %s" % (header))
-
-                    if header == 'MD':
-                        self.parse_header(metadataFilename=self.metadataFilename)
-                    elif header == 'UB':
-                        blockSize = unpack('H', self.fh.read(2))[0]
-                    elif header == 'SI':
-                        pass
-                    elif header == 'AX':
-                        packetLength = unpack('H', self.fh.read(2))[0]               
-                        deviceId = unpack('H', self.fh.read(2))[0]
-                        sessionId = unpack('I', self.fh.read(4))[0]
-                        sequenceId = unpack('I', self.fh.read(4))[0]
-                        sampleTime = self.read_timestamp(self.fh.read(4))
-                        light = unpack('H', self.fh.read(2))[0]
-                        temperature = unpack('H', self.fh.read(2))[0]
-                        events = self.fh.read(1)
-                        battery = unpack('B', self.fh.read(1))[0]
-                        sampleRate = unpack('B', self.fh.read(1))[0]
-                        numAxesBPS = unpack('B', self.fh.read(1))[0]
-                        timestampOffset = unpack('h', self.fh.read(2))[0]
-                        sampleCount = unpack('H', self.fh.read(2))[0]
-                        if parameters.verbose:
-                            print(f"Sample count is {sampleCount}")
-                        
-                        sampleData = io.BytesIO(self.fh.read(480))
-                        checksum = unpack('H', self.fh.read(2))[0]
-                        
-                        if packetLength != 508:
-                            print("Packet length is not 508!", file=sys.stderr)
-                            continue
-                        
-                        if sampleTime == None:
-                            print("Sample time is undefined!", file=sys.stderr)
-                            continue
-                        
-                        if sampleRate == 0:
-                            chksum = 0
-                        else:
-                            # rewind for checksum calculation
-                            self.fh.seek(-packetLength - 4, 1)
-                            # calculate checksum
-                            chksum = 0
-                            for x in range(packetLength // 2 + 2):
-                                chksum += unpack('H', self.fh.read(2))[0]
-                            chksum %= 2 ** 16
-                        
-                        if chksum != 0:
-                            continue
-                        
-                        if sessionId != self.sessionId:
-                            print(f"Bad session ID {sessionId} - should be {self.sessionId}", file=sys.stderr)
-                            continue
-                        
-                        if ((numAxesBPS >> 4) & 15) != 3:
-                            print('[ERROR: Axes!=3 not supported yet -- this will not work properly]', file=sys.stderr)
-
-                        if (light & 0xfc00) != 0:
-                            print('[ERROR: Scale not supported yet -- this will not work properly]', file=sys.stderr)
-                            
-                        if (numAxesBPS & 15) == 2:
-                            bps = 6
-                        elif (numAxesBPS & 15) == 0:
-                            bps = 4
-                        
-                        freq = float(3200) / (1 << (15 - sampleRate & 15))
-                        if freq <= 0:
-                            freq = 1
-                        
-                        # range = 16 >> (rateCode >> 6)
-                        
-                        timeFractional = 0                    
-                        # if top-bit set, we have a fractional date
-                        if deviceId & 0x8000:
-                            # Need to undo backwards-compatible shim
-                            # by calculating how many whole samples
-                            # the fractional part of timestamp
-                            # accounts for.
-                            timeFractional = (deviceId & 0x7fff) * 2     # use original deviceId field bottom 15-bits as 16-bit fractional time
-                            timestampOffset += (timeFractional * int(freq)) // 65536 # undo the backwards-compatible shift (as we have a true fractional)
-                            timeFractional = float(timeFractional) / 65536
-                        
-                        # Add fractional time to timestamp
-                        timestamp = float(time.mktime(sampleTime)) + timeFractional
-                        
-                        # --- Time interpolation ---
-                        # Reset interpolator if there's a sequence break or there was no previous timestamp
-                        if lastSequenceId == None or (lastSequenceId + 1) & 0xffff != sequenceId or lastTimestampOffset == None or lastTimestamp == None:
-                            # Bootstrapping condition is a sample one second ago (assuming the ideal frequency)
-                            lastTimestampOffset = timestampOffset - freq
-                            lastTimestamp = timestamp - 1
-                            lastSequenceId = sequenceId - 1
-                        
-                        localFreq = float(timestampOffset - lastTimestampOffset) / (timestamp - lastTimestamp)
-                        time0 = timestamp + -timestampOffset / localFreq
-                        
-                        # Update for next loop
-                        lastSequenceId = sequenceId
-                        lastTimestampOffset = timestampOffset - sampleCount
-                        lastTimestamp = timestamp
-                        
-                        for x in range(sampleCount):
-                            sample = CWA_Sample()
-                            if bps == 6:
-                                sample.x = unpack('h', sampleData.read(2))[0]
-                                sample.y = unpack('h', sampleData.read(2))[0]
-                                sample.z = unpack('h', sampleData.read(2))[0]
-                            elif bps == 4:
-                                temp = unpack('I', sampleData.read(4))[0]
-                                temp2 = (6 - byte(temp >> 30))
-                                sample.x = short(short((ushort(65472) & ushort(temp << 6))) >> temp2)
-                                sample.y = short(short((ushort(65472) & ushort(temp >> 4))) >> temp2)
-                                sample.z = short(short((ushort(65472) & ushort(temp >> 14))) >> temp2)
-                            
-                            sample.t = time0 + (x / localFreq)
-                            tStr = "{:.5f}".format(sample.t)
-
-                            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(int(floor(sample.t))))
-                            fractionTimestamp = tStr.split(".",1)[1]
-
-                            # Convert 10 us units to ms units
-                            fractionTimestamp = float(fractionTimestamp) / 100
-                            # Integer number of ms
-                            fractionTimestamp = int(fractionTimestamp)
-                            fractionTimestamp = str(fractionTimestamp)
-                            # Pad to three digits.  It is after decimal point so add
-                            # digits to left. e.g. if it is 10 ms, then this would
-                            # be represented as 010 after the decimal point, i.e.
-                            # 0.010
-                            while len(fractionTimestamp) < 3:
-                                fractionTimestamp = "0" + fractionTimestamp
-                            # Units for AX3 are 1/256 g
-                            # Standard gravity is 9.80665
-                            outvals = [sample.x, sample.y, sample.z]
-                            if self.isAnAx3:
-                                if parameters.standardGravity:
-                                    conversionFactor = self.STANDARD_GRAVITY / 256
-                                else:
-                                    conversionFactor = 1/256;
-                                for index in range(len(outvals)):
-                                    outvals[index] = outvals[index] * conversionFactor
-                            out.write("{}.{},{:.06f},{:.06f},{:.06f}{}".format(
-                                timestamp, fractionTimestamp, outvals[0],
-                                outvals[1], outvals[2], lineEnd))
-                                    
-                            linesGenerated += 1
-
-                            if parameters.limit is not None and linesGenerated >= parameters.limit:
-                                return linesGenerated
-                            
-                            if linesGenerated % 1000000 == 0 and linesGenerated != 0:
-                                print(f"{linesGenerated} lines of output generated")
-                    else:
-                        print(f"Unrecognized section header, {header}!", file=sys.stderr)
-                        break
-                    header = self.fh.read(2).decode("ISO-8859-1")
-                
+        incremental = parameters.incremental
+        if incremental and (parameters.start is not None or parameters.end is not None
+                            or parameters.limit is not None):
+            print("Incremental conversion is not possible with a time range or limit, "
+                  "converting without it", file=sys.stderr)
+            incremental = False
+
+        with open(self._filename, 'rb') as self.fh:
+            self.map_sectors(parameters, metadataFilename=self.metadataFilename)
+            first, last = self.sector_range(parameters.start, parameters.end)
+            state = self.read_state(parameters) if incremental else None
+            outputs = [OUTPUT_FORMATS[self.outputFormat](self.outputFilename, parameters,
+                                                         append=state is not None)]
+            if parameters.aux:
+                print(f"Sector light, temperature and battery readings are in {self.auxFilename}")
+                outputs.append(AuxOutput(self.auxFilename, parameters,
+                                         append=state is not None))
+            if state is not None:
+                first = state["sectors"]
+                print(f"Appending sectors from {self.dataSector + first}, "
+                      f"{state['lines']} lines already converted")
+            converted = False
+            try:
+                if parameters.jobs > 1 and parameters.limit is None:
+                    linesGenerated = self.write_shards(outputs, first, last, parameters,
+                                                       finish=not incremental)
+                else:
+                    # Decode in one thread, format in this one and write in
+                    # another for each output
+                    outputs = [ThreadedOutput(output) for output in outputs]
+                    resampler = self.resampler(first, parameters)
+                    for chunk in prefetch(self.sized_chunks(first, last, parameters, state)):
+                        lines = self.write_chunk(outputs, chunk, resampler)
+                        if linesGenerated // 1000000 != (linesGenerated + lines) // 1000000:
+                            print(f"{(linesGenerated + lines) // 1000000 * 1000000} "
+                                  "lines of output generated")
+                        linesGenerated += lines
+                    # An incremental conversion leaves the last interval
+                    # for the next one, which has the samples after it
+                    if not incremental:
+                        linesGenerated += self.write_resampled_tail(outputs, resampler)
+                converted = True
+            finally:
+                if converted:
+                    for output in outputs:
+                        output.close(self)
+                else:
+                    # Stop the writer threads and close the files, keeping
+                    # the error which stopped the conversion
+                    for output in outputs:
+                        try:
+                            output.close()
+                        except Exception:
+                            pass
+            if incremental:
+                self.write_state(parameters, last, linesGenerated +
+                                 (state["lines"] if state is not None else 0))
+            if parameters.index:
+                print(f"Sector index is {self.indexFilename}, gap report is "
+                      f"{self.gapsFilename}")
+                self.write_index()
+
+        self.report_skipped()
+        return linesGenerated
+
+    def iter_chunks(self, parameters=None, chunkSamples=CHUNK_SAMPLES,
+                    metadataFilename=None):
+        """Generator yielding the samples in the file as CWA_Chunk
+        objects of chunkSamples samples each, except for the last,
+        with values in the units selected by parameters.  Only the
+        samples from parameters.start to parameters.end, and up to
+        parameters.limit of them, are included.  parameters defaults to
+        Parameters().  The metadata is written to metadataFilename if it
+        is not None.  Memory use is bounded by the chunk size, so this
+        lets other modules process the samples without going through
+        the CSV file.
+
+        """
+        if parameters is None:
+            parameters = Parameters()
+        with open(self._filename, 'rb') as self.fh:
+            self.map_sectors(parameters, metadataFilename=metadataFilename)
+            first, last = self.sector_range(parameters.start, parameters.end)
+            yield from self.sized_chunks(first, last, parameters, chunkSamples=chunkSamples)
+
+    def sized_chunks(self, first, last, parameters, state=None,
+                     chunkSamples=CHUNK_SAMPLES):
+        """Generator yielding the samples of mapped sectors first up to
+        last, from decode_chunks() with parameters and state, as
+        CWA_Chunk objects of chunkSamples samples each, except for the
+        last.  This is what iter_chunks() yields, and what __call__
+        writes to the output.
+
+        """
+        pending = []
+        pendingSamples = 0
+        for chunk in self.decode_chunks(first, last, parameters, state):
+            pending.append(chunk)
+            pendingSamples += len(chunk)
+            if pendingSamples < chunkSamples:
+                continue
+            chunk = CWA_Chunk.concatenate(pending)
+            for start in range(0, len(chunk) - chunkSamples + 1, chunkSamples):
+                yield chunk.select(slice(start, start + chunkSamples))
+            remainder = len(chunk) % chunkSamples
+            pending = [chunk.select(slice(len(chunk) - remainder, None))]
+            pendingSamples = remainder
+        if pendingSamples != 0:
+            yield CWA_Chunk.concatenate(pending)
+
+    def write_chunk(self, outputs, chunk, resampler=None):
+        """Write a chunk of samples to outputs, the main output followed
+        by the AuxOutput, if there is one.  The samples are resampled
+        by resampler for the main output, unless it is None.  Returns
+        the number of lines written to the main output.
+
+        """
+        for output in outputs[1:]:
+            output.write(chunk)
+        if resampler is not None:
+            chunk = resampler(chunk)
+        outputs[0].write(chunk)
+        return len(chunk)
+
+    def write_resampled_tail(self, outputs, resampler):
+        """Write the values resampler has kept for the intervals at the
+        end of the samples to the main output of outputs, if resampler
+        is not None.  Returns the number of lines written.
+
+        """
+        if resampler is None:
+            return 0
+        chunk = resampler.close()
+        if chunk is None:
+            return 0
+        outputs[0].write(chunk)
+        return len(chunk)
+
+    def resampler(self, first, parameters):
+        """Resampler for the rate parameters.resample, or None if it is
+        None, for the samples from mapped sector first onwards.  The
+        samples of the sectors before first are passed through it
+        first, so that it continues as if they had been converted.
+
+        """
+        if parameters.resample is None:
+            return None
+        resampler = Resampler(parameters.resample, parameters.interpolation)
+        # Don't count these sectors as read or skipped
+        skipped, sectorsRead = self.skipped, self.sectorsRead
+        self.skipped = dict()
+        start = first
+        while start > 0 and not resampler.ready():
+            start = max(0, start - 16)
+            resampler = Resampler(parameters.resample, parameters.interpolation)
+            for chunk in self.decode_chunks(start, first, parameters):
+                resampler(chunk)
+        self.skipped, self.sectorsRead = skipped, sectorsRead
+        return resampler
+
+    def decode_chunks(self, first, last, parameters, state=None):
+        """Generator decoding mapped sectors first up to last, yielding
+        a CWA_Chunk for each run of sectors with values in the units
+        selected by parameters.  Samples outside parameters.start to
+        parameters.end are dropped, and it stops after parameters.limit
+        samples.  state is the interpolator state saved by write_state()
+        for the sectors before first, or None to recover it from them.
+
+        """
+        # Units for AX3 are 1/256 g
+        # Standard gravity is 9.80665
+        conversionFactor = 1
+        if self.isAnAx3:
+            if parameters.standardGravity:
+                conversionFactor = self.STANDARD_GRAVITY / 256
+            else:
+                conversionFactor = 1/256;
+
+        samplesDecoded = 0
+        if state is None:
+            self.bootstrap(first, parameters)
+        else:
+            self.lastSequenceId = state["lastSequenceId"]
+            self.lastTimestampOffset = state["lastTimestampOffset"]
+            self.lastTimestamp = state["lastTimestamp"]
+        for firstSector, sectors in self.read_sectors(first, last):
+            chunk = self.decode_sectors(sectors, parameters, firstSector)
+            if parameters.start is not None or parameters.end is not None:
+                inRange = np.ones(chunk.time.shape, dtype=bool)
+                if parameters.start is not None:
+                    inRange &= chunk.time >= parameters.start
+                if parameters.end is not None:
+                    inRange &= chunk.time < parameters.end
+                chunk = chunk.select(inRange)
+
+            if parameters.limit is not None:
+                chunk = chunk.select(slice(0, parameters.limit - samplesDecoded))
+            samplesDecoded += len(chunk)
+
+            yield chunk.scaled(conversionFactor)
+
+            if parameters.limit is not None and samplesDecoded >= parameters.limit:
+                break
+
+    def write_shards(self, outputs, first, last, parameters, finish=True):
+        """Decode mapped sectors first up to last using parameters.jobs
+        processes, each converting a range of sectors to a temporary
+        part of the outputs, and append the parts to outputs, the main
+        output followed by the AuxOutput with parameters.aux, in order.
+        finish is False to not write the resampled values for the
+        intervals at the end, as for an incremental conversion.
+        Returns the number of lines written.
+
+        """
+        shardSize = max(CHUNK_SECTORS, -(-(last - first) // (parameters.jobs * 4)))
+        shards = [(start, min(start + shardSize, last))
+                  for start in range(first, last, shardSize)]
+        directory = path.dirname(path.abspath(self.outputFilename))
+        shardFilenames = [path.join(directory, f".{path.basename(self.outputFilename)}"
+                                    f".{start}.part")
+                          for start, end in shards]
+        print(f"Converting {last - first} sectors in {len(shards)} parts "
+              f"using {parameters.jobs} processes")
+
+        linesGenerated = 0
+        try:
+            with ProcessPoolExecutor(max_workers=parameters.jobs) as executor:
+                results = executor.map(convert_shard,
+                                       [self._filename] * len(shards),
+                                       [self.outputFormat] * len(shards),
+                                       [start for start, end in shards],
+                                       [end for start, end in shards],
+                                       [parameters] * len(shards),
+                                       shardFilenames,
+                                       [finish and end == last for start, end in shards])
+                for shardFilename, (lines, skipped, sectorsRead) in zip(shardFilenames, results):
+                    for output, partFilename in zip(outputs, (shardFilename,
+                                                              shardFilename + ".aux")):
+                        output.append(partFilename)
+                    linesGenerated += lines
+                    self.sectorsRead += sectorsRead
+                    for reason, sectorNumbers in skipped.items():
+                        self.skipped.setdefault(reason, []).extend(sectorNumbers)
+                    if linesGenerated // 1000000 != (linesGenerated - lines) // 1000000:
+                        print(f"{linesGenerated} lines of output generated")
+        finally:
+            for shardFilename in shardFilenames:
+                if path.isdir(shardFilename):
+                    shutil.rmtree(shardFilename)
+                elif path.exists(shardFilename):
+                    remove(shardFilename)
+                if path.exists(shardFilename + ".aux"):
+                    remove(shardFilename + ".aux")
         return linesGenerated
 
+    def map_sectors(self, parameters, metadataFilename=None, quiet=False):
+        """Parse the "MD" header of the open file, self.fh, and memory
+        map the sectors that follow it.  self.sectors is set to an
+        AX_SECTOR array of the sectors up to the end of the file or the
+        first sector that is not recognized, and self.dataSector to the
+        number of the first of them in the file.  quiet is True to not
+        report an unrecognized sector.
+
+        """
+        # Sectors skipped, by reason
+        self.skipped = dict()
+        self.sectorsRead = 0
+
+        header = self.fh.read(2).decode("ISO-8859-1")
+        if parameters.verbose:
+            print("Section header is %s" % (header))
+        if header == 'MD':
+            self.parse_header(metadataFilename=metadataFilename)
+        else:
+            self.fh.seek(0)
+        self.dataSector = -(-self.fh.tell() // SECTOR_SIZE)
+
+        count = fstat(self.fh.fileno()).st_size // SECTOR_SIZE - self.dataSector
+        if count > 0:
+            self._map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self.sectors = np.frombuffer(self._map, dtype=AX_SECTOR, count=count,
+                                         offset=self.dataSector * SECTOR_SIZE)
+        else:
+            self.sectors = np.zeros((0,), dtype=AX_SECTOR)
+        self.index = None
+
+        headers = self.sectors["header"]
+        known = (headers == b"AX") | (headers == b"UB") | (headers == b"SI")
+        unknown = np.flatnonzero(~known)
+        if unknown.size != 0:
+            if not quiet:
+                header = headers[unknown[0]].decode("ISO-8859-1")
+                print(f"Unrecognized section header, {header}!", file=sys.stderr)
+            self.sectors = self.sectors[:unknown[0]]
+        if parameters.verbose and not quiet:
+            print(f"{self.sectors.size} sectors in file")
+
+    def nominal_rate(self, index=None):
+        """Nominal sample rate, in Hz, of the mapped sectors, the most
+        common rate in the headers of the data sectors, or of the
+        sectors at index, or None if there are none.  The samples don't
+        have to be decoded, so this is the same for a part of the file,
+        or none of it, as for all of it.
+
+        """
+        if index is None:
+            index = np.flatnonzero((self.sectors["header"] == b"AX") &
+                                   (self.sectors["packetLength"] == 508))
+        if index.size == 0:
+            return None
+        rateCode = int(np.argmax(np.bincount(self.sectors["sampleRate"][index])))
+        return 3200.0 / (1 << ((15 - rateCode) & 15))
+
+    def scan(self, parameters=None):
+        """Summarise the file without decoding the samples, from the "MD"
+        header and the fixed fields of each "AX" sector header, which
+        are read from the memory mapped file with strided access.
+        Sector checksums are not checked.  Returns a dictionary with
+        the device and session IDs, the logging start and end times
+        from the header, the sample rate in Hz, the number of data
+        sectors, the times of the first and last samples, estimated
+        from the sector timestamps, and the number of gaps, where the
+        sequence ID of a sector doesn't follow on from the one before.
+
+        """
+        if parameters is None:
+            parameters = Parameters()
+        with open(self._filename, 'rb') as self.fh:
+            self.map_sectors(parameters, quiet=True)
+            summary = {"file": self._filename,
+                       "deviceId": getattr(self, "deviceId", None),
+                       "sessionId": getattr(self, "sessionId", None),
+                       "loggingStart": None,
+                       "loggingEnd": None,
+                       "sampleRate": None,
+                       "sectors": 0,
+                       "firstSampleTime": None,
+                       "lastSampleTime": None,
+                       "gaps": 0}
+            for name, value in (("loggingStart", getattr(self, "loggingStartTime", None)),
+                                ("loggingEnd", getattr(self, "loggingEndTime", None))):
+                if value is not None:
+                    summary[name] = time.strftime("%Y-%m-%d %H:%M:%S", value)
+
+            isData = self.sectors["header"] == b"AX"
+            summary["sectors"] = int(np.count_nonzero(isData))
+            sampleTime = self.read_epochs(self.sectors["sampleTime"])
+            valid = isData & (self.sectors["packetLength"] == 508) & ~np.isnan(sampleTime)
+            if not valid.any():
+                return summary
+            index = np.flatnonzero(valid)
+            ends = index[[0, -1]]
+            summary["sampleRate"] = self.nominal_rate(index)
+
+            # Times of the first sample of the first sector and the last
+            # sample of the last sector, as decode_sectors() calculates
+            # them after a break in the sequence
+            sampleRate = self.sectors["sampleRate"][ends].astype(np.int64)
+            freq = 3200.0 / (1 << ((15 - sampleRate) & 15))
+            deviceId = self.sectors["deviceId"][ends].astype(np.int64)
+            timeFractional = np.where(deviceId & 0x8000, (deviceId & 0x7fff) * 2, 0)
+            timestampOffset = (self.sectors["timestampOffset"][ends].astype(np.int64) +
+                               (timeFractional * freq.astype(np.int64)) // 65536)
+            timestamp = sampleTime[ends] + timeFractional / 65536
+            sampleCount = self.sectors["sampleCount"][ends].astype(np.int64)
+            summary["firstSampleTime"] = format_timestamp(
+                timestamp[0] - timestampOffset[0] / freq[0])
+            summary["lastSampleTime"] = format_timestamp(
+                timestamp[1] + (sampleCount[1] - 1 - timestampOffset[1]) / freq[1])
+
+            sequenceId = self.sectors["sequenceId"][index].astype(np.int64)
+            summary["gaps"] = int(np.count_nonzero(np.diff(sequenceId) != 1))
+        return summary
+
+    def build_index(self):
+        """Build an index of the mapped sectors, holding the time of
+        each sector, in seconds since the epoch, and its sequence ID.
+        The times are made non-decreasing so that the index can be
+        binary searched; sectors without a valid time take the time of
+        the sector before them.
+
+        """
+        if self.index is not None:
+            return self.index
+        sectorTime = self.read_epochs(self.sectors["sampleTime"])
+        deviceId = self.sectors["deviceId"].astype(np.int64)
+        sectorTime += np.where(deviceId & 0x8000, (deviceId & 0x7fff) * 2, 0) / 65536
+        sectorTime[np.isnan(sectorTime) | (self.sectors["header"] != b"AX")] = -np.inf
+        self.index = np.zeros(self.sectors.shape, dtype=[("time", "<f8"),
+                                                         ("sequenceId", "<u4")])
+        self.index["time"] = np.maximum.accumulate(sectorTime) if sectorTime.size else sectorTime
+        self.index["sequenceId"] = self.sectors["sequenceId"]
+        return self.index
+
+    def sector_range(self, start=None, end=None):
+        """Find the mapped sectors which hold the samples from time start
+        up to time end, both in seconds since the epoch or None for the
+        start or end of the file.  Returns the index of the first sector
+        and one past the last.  This only decodes the sector timestamps.
+
+        """
+        first = 0
+        last = self.sectors.size
+        if start is None and end is None:
+            return first, last
+        times = self.build_index()["time"]
+        # The time of a sector is that of one of the samples in or near
+        # it, so allow a couple of sectors either side
+        if start is not None:
+            first = max(0, int(np.searchsorted(times, start, side="right")) - 2)
+        if end is not None:
+            last = min(last, int(np.searchsorted(times, end, side="left")) + 2)
+        return first, max(first, last)
+
+    def bootstrap(self, first, parameters):
+        """Set up the time interpolator to decode from mapped sector
+        first onwards, as if the sectors before it had been decoded.
+        The interpolator state only depends on the last valid sector
+        before it, so the sectors before first are decoded a few at a
+        time, working backwards, until one is found.
+
+        """
+        self.lastSequenceId = None
+        self.lastTimestampOffset = None
+        self.lastTimestamp = None
+        self.lastValidSector = None
+        # Don't count these sectors as read or skipped
+        skipped, sectorsRead = self.skipped, self.sectorsRead
+        self.skipped = dict()
+        end = first
+        while end > 0 and self.lastSequenceId is None:
+            start = max(0, end - 16)
+            self.decode_sectors(self.sectors[start:end], parameters,
+                                self.dataSector + start)
+            end = start
+        self.skipped, self.sectorsRead = skipped, sectorsRead
+
+    def header_hash(self):
+        """ SHA-1 of the file header, before the mapped sectors """
+        self.fh.seek(0)
+        return hashlib.sha1(self.fh.read(self.dataSector * SECTOR_SIZE)).hexdigest()
+
+    def sector_hash(self, index):
+        """ SHA-1 of mapped sector index """
+        return hashlib.sha1(self.sectors[index].tobytes()).hexdigest()
+
+    def state_options(self, parameters):
+        """ The parameters which change the output of a conversion """
+        return {"format": self.outputFormat,
+                "standardGravity": parameters.standardGravity,
+                "linux": parameters.linux,
+                "writeHeader": parameters.writeHeader,
+                "aux": parameters.aux,
+                "resample": parameters.resample,
+                "interpolation": parameters.interpolation,
+                "compression": compression_of(self.outputFilename)}
+
+    def read_state(self, parameters):
+        """Read the sidecar file written by write_state() after the last
+        conversion of the mapped file.  Returns the saved state if the
+        new sectors can be appended to the existing output, or None if
+        the whole file must be converted because there is no state, the
+        file has been truncated or changed, or the output or options
+        have changed.
+
+        """
+        try:
+            with open(self.stateFilename) as stateFile:
+                state = json.load(stateFile)
+        except (OSError, ValueError):
+            print("No incremental conversion state, converting the whole file")
+            return None
+
+        reason = None
+        if state.get("version") != self.STATE_VERSION:
+            reason = "state file version has changed"
+        elif state["options"] != self.state_options(parameters):
+            reason = "conversion options have changed"
+        elif state["outputSize"] != output_size(self.outputFilename):
+            reason = f"{self.outputFilename} has changed"
+        elif parameters.aux and state["auxSize"] != output_size(self.auxFilename):
+            reason = f"{self.auxFilename} has changed"
+        elif (state["sessionId"] != getattr(self, "sessionId", None)
+              or state["headerHash"] != self.header_hash()):
+            reason = "file header has changed"
+        elif state["sectors"] > self.sectors.size:
+            reason = "file has been truncated"
+        elif state["sectors"] > 0 and state["sectorHash"] != self.sector_hash(state["sectors"] - 1):
+            reason = "file data has changed"
+        if reason is not None:
+            print(f"Converting the whole file, {reason}")
+            return None
+        return state
+
+    def write_state(self, parameters, last, lines):
+        """Write the sidecar file for an incremental conversion of the
+        mapped sectors up to last, where lines is the total number of
+        lines in the output.  The next conversion resumes after the last
+        valid sector, so sectors after it which were invalid, perhaps
+        because they were still being written, are decoded again.
+
+        """
+        self.bootstrap(last, parameters)
+        if self.lastValidSector is None:
+            sectors = 0
+        else:
+            sectors = self.lastValidSector - self.dataSector + 1
+        state = {"version": self.STATE_VERSION,
+                 "source": self._filename,
+                 "options": self.state_options(parameters),
+                 "sessionId": getattr(self, "sessionId", None),
+                 "headerHash": self.header_hash(),
+                 "sectors": sectors,
+                 "sectorHash": self.sector_hash(sectors - 1) if sectors > 0 else None,
+                 "lastSequenceId": self.lastSequenceId,
+                 "lastTimestampOffset": self.lastTimestampOffset,
+                 "lastTimestamp": self.lastTimestamp,
+                 "lines": lines,
+                 "outputSize": output_size(self.outputFilename),
+                 "auxSize": output_size(self.auxFilename) if parameters.aux else None}
+        with open(self.stateFilename, "w") as stateFile:
+            json.dump(state, stateFile, indent=2)
+            stateFile.write("\n")
+
+    def read_sectors(self, first=0, last=None):
+        """Generator yielding runs of up to CHUNK_SECTORS of the mapped
+        sectors, from index first up to last, as the number of the first
+        sector of the run in the file and an AX_SECTOR array.
+
+        """
+        if last is None:
+            last = self.sectors.size
+        for start in range(first, last, CHUNK_SECTORS):
+            yield (self.dataSector + start,
+                   self.sectors[start:min(start + CHUNK_SECTORS, last)])
+
+    def skip_sectors(self, reason, sectorNumbers, parameters):
+        """ Record sectors that are being skipped because they are not
+        valid, for report_skipped() """
+        if sectorNumbers.size == 0:
+            return
+        if parameters.verbose:
+            for sectorNumber in sectorNumbers.tolist():
+                print(f"Skip sector {sectorNumber}, {reason}", file=sys.stderr)
+        self.skipped.setdefault(reason, []).extend(sectorNumbers.tolist())
+
+    def report_skipped(self, maxListed=10):
+        """ Print a summary of the sectors that were skipped """
+        skippedCount = sum(len(sectorNumbers) for sectorNumbers in self.skipped.values())
+        if skippedCount == 0:
+            return
+        print(f"Skipped {skippedCount} of {self.sectorsRead} data sectors:", file=sys.stderr)
+        for reason, sectorNumbers in self.skipped.items():
+            listed = ", ".join(str(number) for number in sectorNumbers[:maxListed])
+            if len(sectorNumbers) > maxListed:
+                listed += ", ..."
+            print(f"  {reason}: {len(sectorNumbers)} (sectors {listed})", file=sys.stderr)
+
+    def sector_status(self, sectors, sampleTimes):
+        """Check a run of sectors, an AX_SECTOR array, where sampleTimes
+        is their timestamps from read_epochs().  Returns an array of the
+        status of each of them, an index into SECTOR_STATUS, which is 0
+        for a valid "AX" sector or the first check that it fails.
+
+        """
+        status = np.zeros(sectors.shape, dtype=np.uint8)
+        numAxesBPS = sectors["numAxesBPS"]
+        # The 16 bit sum of all of the words in a sector, including the
+        # checksum itself, is zero.  Sectors with a sample rate of zero
+        # are not checksummed.
+        checks = ((sectors["header"] != b"AX"),
+                  sectors["packetLength"] != 508,
+                  np.isnan(sampleTimes),
+                  (sectors["sampleRate"] != 0) & (sector_checksums(sectors) != 0),
+                  sectors["sessionId"] != getattr(self, "sessionId", None),
+                  ((numAxesBPS & 15) != 2) & ((numAxesBPS & 15) != 0))
+        for code, failed in enumerate(checks, 1):
+            status[(status == 0) & failed] = code
+        return status
+
+    def sector_index(self):
+        """Build the sector index of the mapped sectors, an SECTOR_INDEX
+        array with an entry for each of them, in bulk"""
+        sectors = self.sectors
+        sampleTimes = self.read_epochs(sectors["sampleTime"])
+        deviceId = sectors["deviceId"].astype(np.int64)
+        sampleRate = sectors["sampleRate"].astype(np.int64)
+        index = np.zeros(sectors.shape, dtype=SECTOR_INDEX)
+        index["offset"] = (self.dataSector + np.arange(sectors.size)) * SECTOR_SIZE
+        index["sequenceId"] = sectors["sequenceId"]
+        index["time"] = sampleTimes + np.where(deviceId & 0x8000,
+                                               (deviceId & 0x7fff) * 2, 0) / 65536
+        index["sampleCount"] = sectors["sampleCount"]
+        index["rate"] = 3200.0 / (1 << ((15 - sampleRate) & 15))
+        index["status"] = self.sector_status(sectors, sampleTimes)
+        return index
+
+    def write_index(self):
+        """Write the sector index of the mapped sectors to
+        self.indexFilename, as a .npy file, and a report of the gaps in
+        the data and the invalid sectors to self.gapsFilename.  Returns
+        the index.
+
+        """
+        index = self.sector_index()
+        np.save(self.indexFilename, index)
+        number = index["offset"] // SECTOR_SIZE
+        status = index["status"]
+        valid = np.flatnonzero(status == 0)
+        with open(self.gapsFilename, "w") as out:
+            out.write(f"Sectors of {self._filename}: {index.size}, {valid.size} valid\n")
+
+            # Runs of sectors with the same problem
+            invalid = np.flatnonzero(status != 0)
+            if invalid.size != 0:
+                out.write("Invalid sectors:\n")
+                runStart = invalid[np.r_[True, (np.diff(invalid) != 1) |
+                                         (np.diff(status[invalid]) != 0)]]
+                runEnd = invalid[np.r_[(np.diff(invalid) != 1) |
+                                       (np.diff(status[invalid]) != 0), True]]
+                for start, end in zip(runStart.tolist(), runEnd.tolist()):
+                    sectorRange = (f"{number[start]}" if start == end else
+                                   f"{number[start]}-{number[end]}")
+                    out.write(f"  {sectorRange}: {SECTOR_STATUS[status[start]]}\n")
+
+            # Breaks in the sequence of the valid sectors, including
+            # those where there are invalid sectors
+            before = valid[:-1]
+            after = valid[1:]
+            breaks = np.flatnonzero(index["sequenceId"][after].astype(np.int64) !=
+                                    index["sequenceId"][before].astype(np.int64) + 1)
+            sectorTime = index["time"]
+            # Time not covered by samples, from the end of the sector
+            # before the gap to the start of the one after it
+            missing = (sectorTime[after] - sectorTime[before] -
+                       index["sampleCount"][before] / index["rate"][before])
+            lost = 0.0
+            if breaks.size != 0:
+                out.write("Gaps:\n")
+                for gap in breaks.tolist():
+                    first, last = before[gap], after[gap]
+                    lostTime = max(0.0, float(missing[gap]))
+                    lost += lostTime
+                    out.write(f"  {format_timestamp(sectorTime[first])} to "
+                              f"{format_timestamp(sectorTime[last])}, "
+                              f"sectors {number[first]} to {number[last]}, "
+                              f"sequence {index['sequenceId'][first]} to "
+                              f"{index['sequenceId'][last]}, "
+                              f"about {lostTime:.1f} s missing\n")
+            out.write(f"{breaks.size} gaps, about {lost:.1f} s of data missing\n")
+        return index
+
+    def decode_sectors(self, sectors, parameters, firstSector=0):
+        """Decode a run of sectors.  firstSector is the number of the
+        first of them in the file.  Returns a CWA_Chunk of the samples
+        in the "AX" sectors, with the raw x, y and z values.  Sectors
+        which fail the validity checks are skipped, and recorded by
+        skip_sectors().
+
+        """
+        number = firstSector + np.flatnonzero(sectors["header"] == b"AX")
+        sectors = sectors[sectors["header"] == b"AX"]
+        self.sectorsRead += sectors.size
+
+        sampleTimes = self.read_epochs(sectors["sampleTime"])
+        status = self.sector_status(sectors, sampleTimes)
+        for code in range(2, len(SECTOR_STATUS)):
+            reason = SECTOR_STATUS[code]
+            if reason == "bad session ID":
+                reason = f"bad session ID, should be {self.sessionId}"
+            self.skip_sectors(reason, number[status == code], parameters)
+        valid = status == 0
+
+        numAxesBPS = sectors["numAxesBPS"]
+        checked = valid | (status == SECTOR_STATUS.index("unsupported sample format"))
+        for _ in range(np.count_nonzero(checked & (((numAxesBPS >> 4) & 15) != 3))):
+            print('[ERROR: Axes!=3 not supported yet -- this will not work properly]', file=sys.stderr)
+
+        for _ in range(np.count_nonzero(checked & ((sectors["light"] & 0xfc00) != 0))):
+            print('[ERROR: Scale not supported yet -- this will not work properly]', file=sys.stderr)
+
+        six = (numAxesBPS & 15) == 2
+        four = (numAxesBPS & 15) == 0
+
+        sectors = sectors[valid]
+        number = number[valid]
+        six = six[valid]
+        four = four[valid]
+        sampleTime = sampleTimes[valid]
+        if sectors.size == 0:
+            return CWA_Chunk(np.zeros((0,)), np.zeros((0, 3), dtype=np.int16),
+                             *[np.zeros((0,), dtype=np.uint16)] * 3,
+                             np.zeros((0,), dtype=bool))
+
+        sampleRate = sectors["sampleRate"].astype(np.int64)
+        freq = 3200.0 / (1 << ((15 - sampleRate) & 15))
+        freq[freq <= 0] = 1
+
+        # range = 16 >> (rateCode >> 6)
+
+        deviceId = sectors["deviceId"].astype(np.int64)
+        timestampOffset = sectors["timestampOffset"].astype(np.int64)
+        # if top-bit set, we have a fractional date
+        fractional = (deviceId & 0x8000) != 0
+        # Need to undo backwards-compatible shim by calculating how
+        # many whole samples the fractional part of timestamp accounts
+        # for.  Use original deviceId field bottom 15-bits as 16-bit
+        # fractional time
+        timeFractional = np.where(fractional, (deviceId & 0x7fff) * 2, 0)
+        # undo the backwards-compatible shift (as we have a true fractional)
+        timestampOffset += np.where(fractional,
+                                    (timeFractional * freq.astype(np.int64)) // 65536,
+                                    0)
+        # Add fractional time to timestamp
+        timestamp = sampleTime + timeFractional / 65536
+
+        sampleCount = sectors["sampleCount"].astype(np.int64)
+        if parameters.verbose:
+            for count in sampleCount.tolist():
+                print(f"Sample count is {count}")
+
+        # --- Time interpolation ---
+        # The interpolator state for each sector comes from the sector
+        # before it, and for the first sector from the previous run
+        sequenceId = sectors["sequenceId"].astype(np.int64)
+        lastSequenceId = np.roll(sequenceId, 1)
+        lastTimestampOffset = np.roll(timestampOffset - sampleCount, 1).astype(np.float64)
+        lastTimestamp = np.roll(timestamp, 1)
+        if self.lastSequenceId is None or self.lastTimestampOffset is None or self.lastTimestamp is None:
+            reset0 = True
+        else:
+            reset0 = False
+            lastSequenceId[0] = self.lastSequenceId
+            lastTimestampOffset[0] = self.lastTimestampOffset
+            lastTimestamp[0] = self.lastTimestamp
+        # Reset interpolator if there's a sequence break or there was no previous timestamp
+        reset = (lastSequenceId + 1) & 0xffff != sequenceId
+        reset[0] |= reset0
+        # Bootstrapping condition is a sample one second ago (assuming the ideal frequency)
+        lastTimestampOffset = np.where(reset, timestampOffset - freq, lastTimestampOffset)
+        lastTimestamp = np.where(reset, timestamp - 1, lastTimestamp)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            localFreq = (timestampOffset - lastTimestampOffset) / (timestamp - lastTimestamp)
+            time0 = timestamp + -timestampOffset / localFreq
+
+        # Update for next run
+        self.lastSequenceId = int(sequenceId[-1])
+        self.lastTimestampOffset = int(timestampOffset[-1] - sampleCount[-1])
+        self.lastTimestamp = float(timestamp[-1])
+        self.lastValidSector = int(number[-1])
+
+        # --- Samples ---
+        samples = np.zeros((sectors.size, MAX_SAMPLES[4], 3), dtype=np.int16)
+        sampleData = sectors["sampleData"]
+        if six.any():
+            samples[six, :MAX_SAMPLES[6]] = (
+                np.ascontiguousarray(sampleData[six]).view("<i2").reshape(-1, MAX_SAMPLES[6], 3))
+        if four.any():
+            samples[four] = unpack_packed(
+                np.ascontiguousarray(sampleData[four]).view("<u4"))
+
+        index = np.arange(MAX_SAMPLES[4])
+        inSector = index < np.minimum(sampleCount, np.where(six, MAX_SAMPLES[6],
+                                                            MAX_SAMPLES[4]))[:, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sampleTimes = time0[:, np.newaxis] + (index / localFreq[:, np.newaxis])
+        return CWA_Chunk(sampleTimes[inSector], samples[inSector],
+                         *[np.broadcast_to(sectors[name][:, np.newaxis], inSector.shape)[inSector]
+                           for name in ("light", "temperature", "battery")],
+                         inSector.nonzero()[1] == 0)
+
     # Parse the "MD" format file header
     def parse_header(self, metadataFilename = None):
         blockSize = unpack('H', self.fh.read(2))[0]
@@ -443,6 +1708,61 @@ class CWA:
         
     def read_timestamp(self, stamp):
         stamp = unpack('I', stamp)[0]
+        fields = self._timestamp_fields(stamp)
+        try:
+            t = time.strptime(str(datetime(*fields)), '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            t = None
+        return t
+
+    def read_epoch(self, stamp):
+        """Convert a packed sector timestamp, as an integer, to local
+        time seconds since the epoch in the same way as
+        time.mktime(read_timestamp()), or None if it is not valid
+
+        """
+        fields = self._timestamp_fields(stamp)
+        try:
+            datetime(*fields)
+        except ValueError:
+            return None
+        return float(time.mktime(fields + (0, 0, -1)))
+
+    def read_epochs(self, stamps):
+        """Convert an array of packed sector timestamps to seconds since
+        the epoch, as read_epoch() does for each of them, with NaN for
+        those which are not valid.  mktime() is only called a few times
+        for each hour in the timestamps, rather than for each of them,
+        except in an hour when the clocks change.
+
+        """
+        stamps = np.asarray(stamps, dtype=np.int64)
+        epochs = np.full(stamps.shape, np.nan)
+        hours, inverse = np.unique(stamps >> 12, return_inverse=True)
+        inverse = inverse.reshape(stamps.shape)
+        hourStart, steady = local_hours(
+            [self._timestamp_fields(hour << 12)[:4] for hour in hours.tolist()])
+        mins = (stamps >> 6) & 0x3f
+        secs = stamps & 0x3f
+        valid = ~np.isnan(hourStart[inverse]) & (mins < 60) & (secs < 60)
+        simple = valid & steady[inverse]
+        epochs[simple] = hourStart[inverse[simple]] + mins[simple] * 60 + secs[simple]
+        # mktime() resolves an ambiguous local time using the time zone
+        # offset of the previous call, so call it for the timestamp
+        # before each of these first, as converting one at a time does
+        validIndex = np.flatnonzero(valid)
+        lastIndex = None
+        for index in np.flatnonzero(valid & ~simple).tolist():
+            position = np.searchsorted(validIndex, index)
+            if position > 0 and validIndex[position - 1] != lastIndex:
+                self.read_epoch(int(stamps.flat[validIndex[position - 1]]))
+            epochs.flat[index] = self.read_epoch(int(stamps.flat[index]))
+            lastIndex = index
+        return epochs
+
+    def _timestamp_fields(self, stamp):
+        """ Split packed timestamp into year, month, day, hours,
+        minutes and seconds """
         # bit pattern:  YYYYYYMM MMDDDDDh hhhhmmmm mmssssss
         year  = ((stamp >> 26) & 0x3f) + 2000
         month = (stamp >> 22) & 0x0f
@@ -450,36 +1770,55 @@ class CWA:
         hours = (stamp >> 12) & 0x1f
         mins  = (stamp >>  6) & 0x3f
         secs  = (stamp >>  0) & 0x3f
-        try:
-            t = time.strptime(str(datetime(year,
-                                           month,
-                                           day,
-                                           hours,
-                                           mins,
-                                           secs)), '%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            t = None
-        return t
+        return (year, month, day, hours, mins, secs)
     
+def convert_shard(filename, outputFormat, first, last, parameters, shardFilename,
+                  finish=False):
+    """Process pool worker for CWA.write_shards().  Converts the
+    sectors from index first up to last, after the header, of CWA file
+    filename to shardFilename, in outputFormat, and with parameters.aux
+    the sector readings to shardFilename.aux.  finish is True for the
+    last part, to write the resampled values for the intervals at the
+    end.  Returns the number of lines written, the sectors skipped and
+    the number of sectors read.
+
+    """
+    cwa = CWA(filename, outputFormat)
+    outputs = [OUTPUT_FORMATS[outputFormat](shardFilename, parameters, header=False)]
+    if parameters.aux:
+        outputs.append(AuxOutput(shardFilename + ".aux", parameters, header=False))
+    linesGenerated = 0
+    with open(filename, 'rb') as cwa.fh:
+        cwa.map_sectors(parameters, quiet=True)
+        resampler = cwa.resampler(first, parameters)
+        for chunk in cwa.decode_chunks(first, last, parameters):
+            linesGenerated += cwa.write_chunk(outputs, chunk, resampler)
+        if finish:
+            linesGenerated += cwa.write_resampled_tail(outputs, resampler)
+    for output in outputs:
+        output.close()
+    return linesGenerated, cwa.skipped, cwa.sectorsRead
+
 def main():
     
+    scanOnly = False
     if len(sys.argv) < 2:
         root = tk.Tk()
         root.withdraw()
-        filePath = filedialog.askopenfilename(
-            filetypes = [("Continuous Wave Accelerometer (CWA) format",".CWA")])
+        filePaths = [filedialog.askopenfilename(
+            filetypes = [("Continuous Wave Accelerometer (CWA) format",".CWA")])]
         parameters = Parameters()
     else:
         parser = argparse.ArgumentParser(description="Convert Continuous Wave Accelerometer format files to CSV")
         parser.add_argument("filename",
-                            help="Input filename")
+                            help="Input filename(s)", nargs="+")
         parser.add_argument("--noheader",
                             help="Suppress headings on columns",
                             action = "store_true")
         parser.add_argument("--verbose",
                             help="Verbose output", action="store_true")
         parser.add_argument("--limit",
-                            help="Stop after this number of output lines",
+                            help="Stop after this number of samples, counted before --resample",
                             type=int)
         parser.add_argument("--version",
                             help="Display program version", action="store_true")
@@ -489,26 +1828,91 @@ def main():
         parser.add_argument("--sg",
                             help="Use standard gravity for units",
                             action="store_true")
+        parser.add_argument("--start",
+                            help="Only output samples from this time, "
+                            "YYYY-MM-DD HH:MM:SS")
+        parser.add_argument("--end",
+                            help="Only output samples before this time, "
+                            "YYYY-MM-DD HH:MM:SS")
+        parser.add_argument("--jobs",
+                            help="Number of processes to convert with",
+                            type=int, default=1)
+        parser.add_argument("--format",
+                            help="Output format, csv or columns (binary .npy "
+                            "files for each column)",
+                            choices=sorted(OUTPUT_FORMATS.keys()), default="csv")
+        parser.add_argument("--incremental",
+                            help="Only convert sectors added since the last "
+                            "incremental conversion, appending them to the output",
+                            action="store_true")
+        parser.add_argument("--aux",
+                            help="Also write the light, temperature and battery "
+                            "readings of each sector to <input_file>_aux.csv",
+                            action="store_true")
+        parser.add_argument("--resample",
+                            help="Resample onto a grid of exactly this rate, Hz",
+                            type=float)
+        parser.add_argument("--interpolation",
+                            help="Interpolation for --resample, linear or cubic",
+                            choices=Resampler.METHODS, default="linear")
+        parser.add_argument("--index",
+                            help="Also write an index of the sectors to "
+                            "<input_file>_sectors.npy and a report of the gaps "
+                            "in the data to <input_file>_gaps.txt",
+                            action="store_true")
+        parser.add_argument("--compress",
+                            help="Compress the CSV output files, gzip or zstd",
+                            choices=sorted(EXTENSIONS.keys()))
+        parser.add_argument("--scan",
+                            help="Summarise the files as JSON, without converting them",
+                            action="store_true")
 
         args = parser.parse_args()
         parameters = Parameters(args)
-        filePath = args.filename
+        filePaths = args.filename
+        scanOnly = args.scan
 
-    cwa = CWA(filePath)
-    linesGenerated = cwa(parameters)
-    print(f"{linesGenerated} lines of output generated")
+    if scanOnly:
+        json.dump([scan(filePath) for filePath in filePaths], sys.stdout, indent=2)
+        print()
+        return
+
+    for filePath in filePaths:
+        cwa = CWA(filePath, parameters.outputFormat, parameters.compression)
+        linesGenerated = cwa(parameters)
+        print(f"{linesGenerated} lines of output generated")
 
 def cwa(filePath, verbose=False, limit=None, version=False,
-        linux=False, sg=False, noheader=False, process=True):
-    """ This is an easy to use entry point for other modules
+        linux=False, sg=False, noheader=False, process=True,
+        start=None, end=None, jobs=1, outputFormat="csv", incremental=False,
+        aux=False, resample=None, interpolation="linear", index=False,
+        compression=None):
+    """ This is an easy to use entry point for other modules.  start
+    and end optionally restrict the output to a time range, given as
+    "YYYY-MM-DD HH:MM:SS" strings.  jobs is the number of processes to
+    use for the conversion.  outputFormat is csv or columns.
+    incremental is True to only convert the sectors added since the
+    last incremental conversion.  aux is True to also write the sector
+    light, temperature and battery readings.  resample is a rate, in
+    Hz, to resample the output to, with interpolation linear or cubic.
+    index is True to also write the sector index and gap report.
+    compression is gzip or zstd to compress the CSV output.
     """
-    cwa = CWA(filePath)
+    cwa = CWA(filePath, outputFormat, compression)
     parameters = Parameters()
-    parameters.set(verbose, limit, version, linux, sg, noheader)
+    parameters.set(verbose, limit, version, linux, sg, noheader, start, end, jobs,
+                   outputFormat, incremental, aux, resample, interpolation, index,
+                   compression)
     if process:
         linesGenerated = cwa(parameters)
         print(f"{linesGenerated} lines of output generated")
     return [ cwa.outputFilename, cwa.metadataFilename ]
+
+def scan(filePath):
+    """Summarise a CWA file without converting it.  Returns a
+    dictionary, see CWA.scan().
+    """
+    return CWA(filePath).scan()
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+#
+# BSD 2-Clause License
+#
+# Copyright (c) 2020, Jason Leake
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Statistics of groups of samples, such as those in each minute, worked
+# out for all the groups at once with NumPy grouped reductions rather
+# than a Python loop over the samples.  The samples are sorted by group,
+# keeping them in order within each group, so that each group is a run
+# of consecutive samples, and reduced with np.add.reduceat() etc.
+#
+# e.g.
+#
+# order, keys, starts, counts = group_by(floor_divide(epoch, 60))
+# mean, ptp, rms, std = grouped_stats(x[order], starts, counts)
+#
+
+import numpy as np
+
+def group_by(keys):
+    """Group the samples by keys, an int64 array of the group of each.
+    Returns the indexes which sort the samples by group, or a slice of
+    all of them if they are already in order, and the key, start and
+    number of samples of each group in sorted order.
+
+    """
+    if keys.size > 1 and (keys[1:] < keys[:-1]).any():
+        # Stable, so the samples in each group stay in the same order
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+    else:
+        order = slice(None)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(starts, keys.size))
+    return order, keys[starts], starts, counts
+
+def floor_divide(values, divisor):
+    """Divide float values by divisor, rounding down, as // does, but
+    much faster than np.floor_divide() on floats.  The rounded quotient
+    can only be too big, when it rounds up to a whole number.
+
+    """
+    quotient = np.floor(values / divisor)
+    quotient -= quotient * divisor > values
+    return quotient.astype(np.int64)
+
+def grouped_mean(values, starts, counts):
+    """ Mean of each group of values, which are sorted by group """
+    return np.add.reduceat(values, starts) / counts
+
+def grouped_stats(values, starts, counts):
+    """Mean, peak to peak, root mean square and standard deviation of
+    each group of values, which are sorted by group.  The standard
+    deviation is worked out from the differences from the mean, as
+    numpy.std() does.
+
+    """
+    mean = grouped_mean(values, starts, counts)
+    ptp = np.maximum.reduceat(values, starts) - np.minimum.reduceat(values, starts)
+    rms = np.sqrt(np.add.reduceat(values * values, starts) / counts)
+    deviation = np.repeat(mean, counts)
+    np.subtract(values, deviation, out=deviation)
+    np.multiply(deviation, deviation, out=deviation)
+    std = np.sqrt(np.add.reduceat(deviation, starts) / counts)
+    return mean, ptp, rms, std
+
+class GroupStream:
+    """Groups samples which are read a chunk at a time, as group_by()
+    does for all of them at once, giving each group once it is
+    complete.  Only the samples of the last group so far are kept, as
+    the next chunk may have more of them, so the keys of each chunk must
+    be no less than that group's key.
+
+    """
+
+    def __init__(self):
+        # Key and values of the samples of the last group so far
+        self.keys = None
+        self.columns = None
+
+    def add(self, keys, columns):
+        """Add a chunk of samples, with int64 keys and a list of arrays of
+        their values.  Returns the key, start and number of samples of
+        each group which is now complete, and the list of values sorted
+        by group, as group_by() does.
+
+        """
+        if self.keys is not None:
+            if keys.size > 0 and keys.min() < self.keys[0]:
+                raise ValueError(f"Samples for group {keys.min()} follow group {self.keys[0]}")
+            keys = np.concatenate((self.keys, keys))
+            columns = [np.concatenate(pair) for pair in zip(self.columns, columns)]
+        if keys.size == 0:
+            return self._groups(keys, columns)
+        order, groupKeys, starts, counts = group_by(keys)
+        columns = [values[order] for values in columns]
+        # Keep the last group, which may not be complete
+        last = starts[-1]
+        self.keys = keys[order][last:].copy()
+        self.columns = [values[last:].copy() for values in columns]
+        return groupKeys[:-1], starts[:-1], counts[:-1], [values[:last] for values in columns]
+
+    def close(self):
+        """ The last group, once there are no more samples, in the same
+        form as add() """
+        keys, columns = self.keys, self.columns
+        self.keys = None
+        self.columns = None
+        if keys is None:
+            return self._groups(np.empty(0, np.int64), [])
+        return self._groups(keys, columns)
+
+    def _groups(self, keys, columns):
+        """ The group of keys, which are all the same, or no groups if
+        there are none """
+        if keys.size == 0:
+            empty = np.empty(0, np.int64)
+            return empty, empty, empty, columns
+        return keys[:1], np.zeros(1, np.int64), np.array([keys.size]), columns
+
+class RunningStats:
+    """Number of values, minimum, maximum, mean and standard deviation
+    of values added a chunk at a time.  The mean and sum of the squared
+    differences from it of each chunk are combined with those of the
+    chunks before it, as in Chan et al.'s parallel form of Welford's
+    online algorithm, which is as accurate as working them out from all
+    the values at once.
+
+    """
+
+    def __init__(self, values=None):
+        self.count = 0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.mean = 0.0
+        # Sum of squared differences from the mean
+        self.m2 = 0.0
+        if values is not None:
+            self.add(values)
+
+    def add(self, values):
+        """ Add an array of values """
+        count = values.size
+        if count == 0:
+            return
+        mean = values.mean()
+        deviation = values - mean
+        m2 = np.dot(deviation, deviation)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+
+    def std(self):
+        """ Standard deviation, as numpy.std() """
+        return np.sqrt(self.m2 / self.count)
+
+    def ptp(self):
+        """ Peak to peak """
+        return self.maximum - self.minimum
@@ -29,6 +29,7 @@
 #
 # Remove idle portions from CSV accelerometer file
 #
+from compression import open_input
 import argparse
 import sys
 
@@ -71,7 +72,7 @@ class Processor:
         isIdle = False
         startIdleTime = None
         idleTime = 0
-        with open(filename, "r") as self.fh:
+        with open_input(filename) as self.fh:
             line = self.fh.readline()
             while line:
                 row = Row(line)
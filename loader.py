@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+#
+# BSD 2-Clause License
+#
+# Copyright (c) 2020, Jason Leake
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Fast loading of the "datetime, x, y, z" CSV files written by cwa.py
+# into NumPy arrays.  The file, which may be compressed, is read a
+# million lines at a time, and each block of lines is parsed by NumPy
+# in one go rather than by making a Row object for each line.  Header
+# lines and bad lines are skipped, with the same messages, as Row skips
+# them.  The timestamps, which cwa.py writes in UTC, are converted to
+# epoch times in UTC unless another time zone is given, see
+# timestamps.py.
+#
+# e.g.
+#
+# for chunk in Loader("wrist.csv"):
+#     print(len(chunk), chunk.epoch[0], chunk.x.mean(), chunk.tot().max())
+#
+# or to read the whole file into one Chunk
+#
+# data = Loader("wrist.csv").load()
+#
+# The arrays parsed from a file are cached, see cache.py, so reading it
+# again is much quicker.  A file which isn't compressed can be parsed
+# by several processes at once, each parsing a range of its lines,
+# e.g.
+#
+# data = Loader("wrist.csv", jobs=8).load()
+#
+
+from compression import detect_compression
+from concurrent.futures import ProcessPoolExecutor
+import cache
+import contextlib
+import io
+import itertools
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import os
+import sys
+from timeindex import open_range, open_times, parse_time_ms, time_index
+from timestamps import LOCAL, TIMESTAMP_LENGTH, UTC, TimestampParser
+
+# Number of lines read and parsed at a time
+CHUNK_LINES = 1000000
+
+# Smallest number of bytes of the file parsed by each process
+SHARD_BYTES = 1 << 22
+
+# Number of ranges of the file for each process, so that the processes
+# which finish first can parse another one
+SHARDS_PER_JOB = 4
+
+# Attributes of a Chunk which are NumPy arrays
+COLUMNS = ("timestamp", "epoch", "x", "y", "z")
+
+# Fields of a line.  The timestamp has room for one more character so
+# that longer ones can be spotted.
+ROW_DTYPE = [("timestamp", f"U{TIMESTAMP_LENGTH + 1}"),
+             ("x", "f8"), ("y", "f8"), ("z", "f8")]
+
+class Chunk:
+    """Consecutive rows of an AX3 CSV file, as NumPy arrays: timestamp
+    holds the timestamp strings, epoch the times in seconds since
+    1/1/1970, or None if they weren't wanted, and x, y and z the
+    values.  lines is the list of the lines themselves, or None if they
+    weren't wanted.
+
+    """
+
+    def __init__(self, timestamp, epoch, x, y, z, lines=None, tot=None):
+        self.timestamp = timestamp
+        self.epoch = epoch
+        self.x = x
+        self.y = y
+        self.z = z
+        self.lines = lines
+        self._tot = tot
+
+    def __len__(self):
+        return self.x.size
+
+    def tot(self):
+        """ Total acceleration of each row, as Row.getTotAcc() """
+        # Lazy evaluation
+        if self._tot is None:
+            self._tot = np.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+        return self._tot
+
+    def date(self):
+        """ Date part of each timestamp, as Row.date """
+        return np.char.partition(self.timestamp, " ")[:, 0]
+
+class Loader:
+    """Reads an AX3 CSV file a chunk of rows at a time.  Iterating over
+    it yields a Chunk for up to chunkLines lines of the file.  verbose
+    is True to report header lines being skipped, epoch is False if the
+    epoch times are not needed and keepLines is True to keep the lines
+    of each chunk too.  tz is the time zone the timestamps are in, UTC,
+    as cwa.py writes them, LOCAL for the local time zone, as
+    Row.getEpoch() takes them, or the name of a time zone, such as
+    "Europe/London".  start and end are times, in the same form as the
+    timestamps, e.g. "2020-02-27 10:00", to only read the rows from
+    start up to end, skipping to them with the file's time index, see
+    timeindex.py.  cache is False to always parse the file, rather
+    than use or write the cache, which it can't do when keepLines is
+    True or when reading a range of times.  Like the tools always have,
+    it stops at the first empty line.  When the rows come from the
+    cache, the header lines and bad lines are not reported again.  jobs
+    is the number of processes to parse the file with, which is only
+    done when it isn't compressed and keepLines is False.  Each parses
+    a range of lines, and their Chunks are yielded in order.
+
+    """
+
+    def __init__(self, filename, verbose=True, epoch=True, keepLines=False,
+                 chunkLines=CHUNK_LINES, cache=True, tz=UTC, start=None, end=None,
+                 jobs=1):
+        self.filename = filename
+        self.verbose = verbose
+        self.epoch = epoch
+        self.keepLines = keepLines
+        self.chunkLines = chunkLines
+        self.parser = TimestampParser(tz)
+        # Range of times to read, in milliseconds since the epoch taking
+        # the timestamps as UTC, as the time index does
+        self.times = (start, end)
+        self.start = parse_time_ms(start)
+        self.end = parse_time_ms(end)
+        self.ranged = self.start is not None or self.end is not None
+        self.cache = cache and not keepLines and not self.ranged
+        self.jobs = jobs
+        # Bytes of the file to read, or None for the range of times
+        self.byteRange = None
+        # Number of characters in the lines read so far
+        self.charactersRead = 0
+        # True if reading stopped at an empty line
+        self.stopped = False
+
+    def __iter__(self):
+        columns = self._read_cache()
+        if columns is None:
+            yield from self._parse_file()
+            return
+        for start in range(0, columns["x"].size, self.chunkLines):
+            yield self._cached_chunk(columns, start, start + self.chunkLines)
+
+    def _read_cache(self):
+        """ The columns cached for the file, or None """
+        return cache.read(self.filename, self.parser.key()) if self.cache else None
+
+    def _cached_chunk(self, columns, start, end):
+        """ Chunk of rows start to end of the cached columns """
+        return Chunk(columns["timestamp"][start:end].astype(f"U{TIMESTAMP_LENGTH}"),
+                     columns["epoch"][start:end] if self.epoch else None,
+                     columns["x"][start:end], columns["y"][start:end],
+                     columns["z"][start:end], tot=columns["tot"][start:end])
+
+    def _parse_file(self):
+        """ Generate the Chunks parsed from the file, and cache them """
+        writer = cache.Writer(self.filename, self.parser.key()) if self.cache else None
+        shards = self._shards()
+        try:
+            chunks = self._parse_shards(shards) if len(shards) > 1 else self._chunks()
+            for chunk in chunks:
+                if writer is not None:
+                    writer.write(chunk)
+                if not self.epoch:
+                    chunk.epoch = None
+                yield chunk
+        except BaseException:
+            # Including the caller not reading to the end
+            if writer is not None:
+                writer.abandon()
+            raise
+        if writer is not None:
+            writer.close()
+
+    def _chunks(self):
+        """ Generate the Chunks parsed from the file, or its byteRange """
+        for lines in self._blocks():
+            lines = self._select(lines)
+            if lines:
+                chunk = self._parse(lines)
+                if len(chunk) > 0:
+                    yield chunk
+
+    def _shards(self):
+        """ Split the part of the file to read into ranges of bytes for
+        the processes to parse, each starting at the start of a line.
+        Returns a list of one range if the file is to be parsed by this
+        process """
+        if self.jobs <= 1 or self.keepLines or detect_compression(self.filename) is not None:
+            return [None]
+        first, last = 0, None
+        if self.ranged:
+            first, last = time_index(self.filename).byte_range(self.start, self.end)
+        if last is None:
+            last = os.path.getsize(self.filename)
+        count = min(self.jobs * SHARDS_PER_JOB, (last - first) // SHARD_BYTES)
+        if count <= 1:
+            return [None]
+        step = -(-(last - first) // count)
+        bounds = [first]
+        with open(self.filename, "rb") as fh:
+            for position in range(first + step, last, step):
+                if position <= bounds[-1]:
+                    continue
+                # The next line starting at or after position
+                fh.seek(position - 1)
+                fh.readline()
+                if fh.tell() >= last:
+                    break
+                bounds.append(fh.tell())
+        bounds.append(last)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _parse_shards(self, shards):
+        """Generate the Chunks parsed from the ranges of bytes, shards,
+        by a pool of self.jobs processes, in order.  The messages about
+        the lines skipped are output in order too.  The epoch times of
+        local times are worked out here, as mktime() depends on the
+        times converted before.
+
+        """
+        localEpochs = self.parser.tz == LOCAL and (self.epoch or self.cache)
+        self.charactersRead = 0
+        # Start the tracker of the shared memory blocks before the pool,
+        # so that the processes share it rather than each starting their
+        # own, which would try to free the blocks again when they exit
+        resource_tracker.ensure_running()
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(parse_shard, self.filename, first, last,
+                                       self.verbose, self.epoch or self.cache,
+                                       self.parser.tz, self.times, self.chunkLines)
+                       for first, last in shards]
+            try:
+                for future in futures:
+                    chunk, stopped, messages, characters = take_shared(*future.result())
+                    sys.stderr.write(messages)
+                    self.charactersRead += characters
+                    if localEpochs:
+                        chunk.epoch = self.parser.seconds(chunk.timestamp)
+                    if len(chunk) > 0:
+                        yield chunk
+                    if stopped:
+                        # Like the tools always have, stop at the first
+                        # empty line
+                        self.stopped = True
+                        break
+            finally:
+                # Free the shared memory of the shards not used
+                for future in futures:
+                    if not future.cancel():
+                        with contextlib.suppress(Exception):
+                            take_shared(*future.result())
+
+    def load(self):
+        """Read the whole file, in one pass, into a single Chunk.  The
+        arrays are allocated for the number of rows estimated from the
+        size of the file, grown by half as much again each time they are
+        full, and trimmed to the number of rows read at the end.
+
+        """
+        columns = self._read_cache()
+        if columns is not None:
+            return self._cached_chunk(columns, 0, columns["x"].size)
+        columns = {}
+        lines = [] if self.keepLines else None
+        size = 0
+        capacity = 0
+        for chunk in self._parse_file():
+            if not columns:
+                capacity = self._estimate_rows(len(chunk))
+                columns = { name: np.empty(capacity, dtype=getattr(chunk, name).dtype)
+                            for name in COLUMNS if getattr(chunk, name) is not None }
+            end = size + len(chunk)
+            if end > capacity:
+                capacity = max(end, capacity + capacity // 2)
+                for column in columns.values():
+                    column.resize(capacity, refcheck=False)
+            for name, column in columns.items():
+                values = getattr(chunk, name)
+                if values.dtype != column.dtype:
+                    # Longer timestamps than before
+                    column = column.astype(np.promote_types(column.dtype, values.dtype))
+                    columns[name] = column
+                column[size:end] = values
+            if lines is not None:
+                lines.extend(chunk.lines)
+            size = end
+        if not columns:
+            return Chunk(np.empty(0, dtype=f"U{TIMESTAMP_LENGTH}"),
+                         np.empty(0) if self.epoch else None,
+                         np.empty(0), np.empty(0), np.empty(0), lines)
+        for column in columns.values():
+            column.resize(size, refcheck=False)
+        return Chunk(columns["timestamp"], columns.get("epoch"),
+                     columns["x"], columns["y"], columns["z"], lines)
+
+    def _estimate_rows(self, rows):
+        """ Estimate the number of rows in the file from the number,
+        rows, in the lines read so far.  A compressed file is not
+        estimated, as its size says little about the number of rows,
+        and nor is a range of times """
+        if (self.charactersRead == 0 or self.ranged or
+            detect_compression(self.filename) is not None):
+            return rows
+        # Allow a little for the lines getting longer
+        return max(rows, int(rows * 1.05 * os.path.getsize(self.filename) / self.charactersRead))
+
+    def count(self):
+        """ Count the rows of data in the file, without converting them.
+        Rows whose values are not numbers are still counted """
+        return sum(len(self._select(lines)) for lines in self._blocks())
+
+    def _blocks(self):
+        """ Generate lists of lines of the file, with their leading and
+        trailing whitespace removed """
+        self.charactersRead = 0
+        self.stopped = False
+        if self.byteRange is not None:
+            fh = open_range(self.filename, *self.byteRange, newline="\n")
+        else:
+            fh = open_times(self.filename, self.start, self.end, newline="\n")
+        with fh:
+            while True:
+                lines = list(itertools.islice(fh, self.chunkLines))
+                if not lines:
+                    return
+                self.charactersRead += sum(map(len, lines))
+                lines = list(map(str.strip, lines))
+                try:
+                    end = lines.index("")
+                except ValueError:
+                    yield lines
+                    continue
+                self.stopped = True
+                if end > 0:
+                    yield lines[:end]
+                return
+
+    def _select(self, lines):
+        """ The lines that Row would decode, reporting the others as Row
+        does """
+        commas = np.fromiter(map(str.count, lines, itertools.repeat(",")),
+                             dtype=np.int64, count=len(lines))
+        headers = np.fromiter(map(str.startswith, lines, itertools.repeat("datetime")),
+                              dtype=bool, count=len(lines))
+        skip = headers | (commas != 3)
+        if not skip.any():
+            return lines
+        for index in np.flatnonzero(skip).tolist():
+            if headers[index]:
+                if self.verbose:
+                    print(f"Skip header line {lines[index]}", file=sys.stderr)
+            else:
+                print(f"Ignore {lines[index]}", file=sys.stderr)
+        return list(itertools.compress(lines, ~skip))
+
+    def _parse(self, lines):
+        """ Convert lines, which all have four fields, to a Chunk """
+        converted, timestamp, x, y, z = convert(lines)
+        if self.keepLines and not converted.all():
+            lines = list(itertools.compress(lines, converted))
+        if self.ranged:
+            milliseconds = TimestampParser(UTC).milliseconds(timestamp)
+            inRange = np.ones(timestamp.shape, dtype=bool)
+            if self.start is not None:
+                inRange &= milliseconds >= self.start
+            if self.end is not None:
+                inRange &= milliseconds < self.end
+            if not inRange.all():
+                timestamp, x, y, z = timestamp[inRange], x[inRange], y[inRange], z[inRange]
+                if self.keepLines:
+                    lines = list(itertools.compress(lines, inRange))
+        # The cache needs the epoch times
+        epoch = self.parser.seconds(timestamp) if self.epoch or self.cache else None
+        return Chunk(timestamp, epoch, x, y, z, lines if self.keepLines else None)
+
+def convert(lines):
+    """Convert lines, which all have four fields, to NumPy arrays.
+    Returns a boolean array of which lines were converted, which is all
+    of them except those with values which aren't numbers, reported as
+    Row does, and the timestamps and x, y and z values of those lines.
+
+    """
+    try:
+        rows = np.loadtxt(lines, delimiter=",", dtype=ROW_DTYPE, comments=None, ndmin=1)
+        converted = np.ones(len(lines), dtype=bool)
+        timestamp = rows["timestamp"]
+        x, y, z = rows["x"], rows["y"], rows["z"]
+        if (np.char.str_len(timestamp) != TIMESTAMP_LENGTH).any():
+            # Not all from cwa.py, so take them as Row does
+            timestamp = np.array([line.split(",", 1)[0].strip() for line in lines])
+    except ValueError:
+        converted, timestamp, x, y, z = convert_lines(lines)
+    if timestamp.dtype.itemsize == TIMESTAMP_LENGTH * 4 + 4:
+        timestamp = timestamp.astype(f"U{TIMESTAMP_LENGTH}")
+    return converted, timestamp, x, y, z
+
+def convert_lines(lines):
+    """ Convert lines one at a time, dropping those with values which
+    aren't numbers, as Row does """
+    converted = np.zeros(len(lines), dtype=bool)
+    timestamp = []
+    values = []
+    for index, line in enumerate(lines):
+        fields = line.split(",")
+        try:
+            values.append([float(field) for field in fields[1:]])
+        except ValueError:
+            print(f"Conversion error, ignore {line}", file=sys.stderr)
+            continue
+        converted[index] = True
+        timestamp.append(fields[0].strip())
+    values = np.array(values, dtype=np.float64).reshape(-1, 3)
+    return (converted, np.array(timestamp, dtype=str),
+            values[:, 0].copy(), values[:, 1].copy(), values[:, 2].copy())
+
+def parse_shard(filename, first, last, verbose, epoch, tz, times, chunkLines):
+    """Parse bytes first up to last of file filename, in a process of
+    the pool of a Loader with the other arguments, and put the columns
+    in a block of shared memory, so that they don't have to be pickled.
+    Returns what take_shared() needs to get them back, plus whether the
+    range has an empty line, the messages about the lines skipped and
+    the number of characters read.
+
+    """
+    start, end = times
+    loader = Loader(filename, verbose=verbose, epoch=epoch and tz != LOCAL,
+                    chunkLines=chunkLines, cache=False, tz=tz, start=start, end=end)
+    loader.byteRange = (first, last)
+    messages = io.StringIO()
+    with contextlib.redirect_stderr(messages):
+        chunks = list(loader._chunks())
+    columns = [(name, np.concatenate([getattr(chunk, name) for chunk in chunks]))
+               for name in COLUMNS
+               if chunks and getattr(chunks[0], name) is not None]
+    rows = sum(map(len, chunks))
+    del chunks
+    memory = shared_memory.SharedMemory(
+        create=True, size=max(1, sum(column.nbytes for name, column in columns)))
+    layout = []
+    offset = 0
+    for name, column in columns:
+        np.ndarray(column.shape, dtype=column.dtype, buffer=memory.buf, offset=offset)[:] = column
+        layout.append((name, column.dtype.str, offset))
+        offset += column.nbytes
+    memory.close()
+    return (memory.name, rows, layout, loader.stopped, messages.getvalue(),
+            loader.charactersRead)
+
+def take_shared(name, rows, layout, stopped, messages, characters):
+    """ Copy the columns parse_shard() put in shared memory block name
+    to a Chunk, and free the block.  Returns the Chunk, and the rest of
+    what parse_shard() returned """
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        columns = { column: np.ndarray(rows, dtype=dtype, buffer=memory.buf, offset=offset).copy()
+                    for column, dtype, offset in layout }
+    finally:
+        memory.close()
+        memory.unlink()
+    if not columns:
+        columns = { "timestamp": np.empty(0, dtype=f"U{TIMESTAMP_LENGTH}"),
+                    "x": np.empty(0), "y": np.empty(0), "z": np.empty(0) }
+    chunk = Chunk(columns["timestamp"], columns.get("epoch"),
+                  columns["x"], columns["y"], columns["z"])
+    return chunk, stopped, messages, characters
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+#
+# BSD 2-Clause License
+#
+# Copyright (c) 2020, Jason Leake
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Tests of cwa.py, converting the sample data
+#
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import cwa
+
+# Sample CWA file, of 25 Hz data
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_data",
+                      "sleeve", "sewing and watching tv", "CWA-DATA.CWA")
+
+class ColumnOutputTest(unittest.TestCase):
+    """ Tests of --format columns """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def convert(self, name, **options):
+        """ Convert a copy of the sample file, called name, to columns
+        with options.  Returns the header and columns """
+        filename = os.path.join(self.directory, name)
+        if not os.path.exists(filename):
+            shutil.copy(SAMPLE, filename)
+        with contextlib.redirect_stdout(io.StringIO()), \
+             contextlib.redirect_stderr(io.StringIO()):
+            cwa.cwa(filename, outputFormat="columns", **options)
+        return cwa.load_columns(os.path.splitext(filename)[0] + "_columns", mmap_mode=None)
+
+    def assertSameColumns(self, columns, expected):
+        self.assertEqual(columns.keys(), expected.keys())
+        for name in expected:
+            np.testing.assert_array_equal(columns[name], expected[name])
+
+    def test_jobs(self):
+        """ The output with --jobs, where the samples are decoded by
+        other processes, is the same as with one process """
+        header, columns = self.convert("single.CWA")
+        self.assertEqual(header["sampleRate"], 25.0)
+        jobsHeader, jobsColumns = self.convert("jobs.CWA", jobs=2)
+        self.assertEqual(jobsHeader["sampleRate"], 25.0)
+        self.assertEqual(jobsHeader["rows"], header["rows"])
+        self.assertSameColumns(jobsColumns, columns)
+
+    def test_incremental_no_new_data(self):
+        """ An incremental conversion which finds no new sectors leaves
+        the output as it was """
+        header, columns = self.convert("incremental.CWA", incremental=True)
+        self.assertEqual(header["sampleRate"], 25.0)
+        againHeader, againColumns = self.convert("incremental.CWA", incremental=True)
+        self.assertEqual(againHeader, header)
+        self.assertSameColumns(againColumns, columns)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+#
+# BSD 2-Clause License
+#
+# Copyright (c) 2020, Jason Leake
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Sparse time index of an AX3 CSV file, so that a range of times can be
+# read from a long recording without reading the whole file.  The index
+# holds the byte offset of every STRIDE'th line of the file and the
+# time of its timestamp, and is kept in a sidecar file, e.g.
+# wrist_times.npz for wrist.csv, which is built the first time a range
+# of times is read from the file and rebuilt if the file changes.
+# Compressed files can't be read from part way through, so they are not
+# indexed, and are read from the start.
+#
+# Times are given in the same form, and time zone, as the timestamps in
+# the file, e.g. "2020-02-27 10:00" or "2020-02-27 10:00:00.000".
+#
+# e.g.
+#
+# with open_times("wrist.csv", parse_time_ms("2020-02-27 10:00"),
+#                 parse_time_ms("2020-02-27 12:00")) as fh:
+#     line = fh.readline()
+#
+# opens wrist.csv at a line no later than the first one at or after
+# 10:00, and ends it no earlier than the last one before 12:00.
+#
+
+import argparse
+from compression import detect_compression, open_input
+import io
+import numpy as np
+import os
+import sys
+from timestamps import UTC, TimestampParser, parse_time
+
+# Number of lines between the lines in the index
+STRIDE = 10000
+
+# Number of bytes read at a time when building the index
+BLOCK_SIZE = 1 << 24
+
+# Most bytes read to find the timestamp of a line
+TIMESTAMP_BYTES = 64
+
+def parse_time_ms(text):
+    """ timestamps.parse_time() of text in milliseconds, as the
+    timestamps in the index are.  None is returned as None """
+    seconds = parse_time(text)
+    return None if seconds is None else round(seconds * 1000)
+
+def index_filename(filename):
+    """ Name of the index file of CSV file filename """
+    return os.path.splitext(filename)[0] + "_times.npz"
+
+class TimeIndex:
+    """Byte offset, offset, and timestamp, milliseconds, of every
+    stride'th line of a CSV file, leaving out those without a
+    timestamp, such as header lines.  stop is the offset of the first
+    empty line, where the tools stop reading, or None.  size and mtime
+    are the size and modification time of the file when it was indexed.
+
+    """
+
+    def __init__(self, offset, milliseconds, stop, size, mtime):
+        self.offset = offset
+        self.milliseconds = milliseconds
+        self.stop = stop
+        self.size = size
+        self.mtime = mtime
+
+    def sorted(self):
+        """ True if the timestamps indexed are in order, which they must
+        be for the index to be used """
+        return not (np.diff(self.milliseconds) < 0).any()
+
+    def byte_range(self, start=None, end=None):
+        """Return the byte offsets of the part of the file holding the
+        lines timed from start up to end, milliseconds since the epoch
+        or None for the start or end of the file.  The end offset is
+        None for the end of the file.  The part may hold some lines
+        either side of the range.
+
+        """
+        first = 0
+        last = self.stop
+        if not self.sorted():
+            return first, last
+        if start is not None:
+            # Last line indexed before start, all the lines before which
+            # are before start too
+            before = np.searchsorted(self.milliseconds, start, side="left") - 1
+            if before >= 0:
+                first = int(self.offset[before])
+        if end is not None:
+            # First line indexed at or after end
+            after = np.searchsorted(self.milliseconds, end, side="left")
+            if after < self.offset.size:
+                last = int(self.offset[after])
+                if self.stop is not None:
+                    last = min(last, self.stop)
+        return first, last
+
+    def save(self, filename):
+        """ Write the index to file filename """
+        np.savez(filename, offset=self.offset, milliseconds=self.milliseconds,
+                 stop=-1 if self.stop is None else self.stop,
+                 size=self.size, mtime=self.mtime)
+
+def build_index(filename, stride=STRIDE):
+    """ Build the time index of CSV file filename, which must not be
+    compressed, and write it to its index file.  Returns the index """
+    status = os.stat(filename)
+    # Line 0 starts at offset 0
+    offsets = [0]
+    stop = None
+    with open(filename, "rb") as fh:
+        position = 0
+        # Number of lines ended so far, and the start of the next one
+        linesEnded = 0
+        lineStart = 0
+        while stop is None:
+            block = fh.read(BLOCK_SIZE)
+            if not block:
+                break
+            newlines = position + np.flatnonzero(
+                np.frombuffer(block, dtype=np.uint8) == ord("\n"))
+            # Number of the line starting after each newline
+            numbers = linesEnded + 1 + np.arange(newlines.size)
+            offsets.extend((newlines[numbers % stride == 0] + 1).tolist())
+            # Lines which might be empty, allowing for a carriage return
+            # and a space
+            lineStarts = np.concatenate(([lineStart], newlines[:-1] + 1))
+            lengths = newlines - lineStarts
+            for index in np.flatnonzero(lengths <= 2).tolist():
+                line = os.pread(fh.fileno(), int(lengths[index]), int(lineStarts[index]))
+                if line.strip() == b"":
+                    stop = int(lineStarts[index])
+                    break
+            if newlines.size > 0:
+                lineStart = int(newlines[-1]) + 1
+            linesEnded += newlines.size
+            position += len(block)
+
+        # Timestamps of the lines indexed
+        offset = []
+        stamps = []
+        for lineOffset in offsets:
+            if stop is not None and lineOffset >= stop:
+                break
+            fh.seek(lineOffset)
+            stamp = fh.read(TIMESTAMP_BYTES).split(b",", 1)[0].strip()
+            offset.append(lineOffset)
+            stamps.append(stamp.decode("utf-8", errors="replace"))
+    milliseconds, valid = timestamp_milliseconds(stamps)
+    index = TimeIndex(np.array(offset, dtype=np.int64)[valid], milliseconds[valid],
+                      stop, status.st_size, status.st_mtime_ns)
+    index.save(index_filename(filename))
+    return index
+
+def timestamp_milliseconds(stamps):
+    """ Convert a list of timestamp strings to milliseconds since the
+    epoch, as UTC.  Returns them, and a boolean array which is False
+    for those which aren't timestamps """
+    parser = TimestampParser(UTC)
+    stamps = np.array(stamps, dtype=str)
+    try:
+        return parser.milliseconds(stamps), np.ones(stamps.size, dtype=bool)
+    except ValueError:
+        pass
+    milliseconds = np.zeros(stamps.size, dtype=np.int64)
+    valid = np.zeros(stamps.size, dtype=bool)
+    for index in range(stamps.size):
+        try:
+            milliseconds[index] = parser.milliseconds(stamps[index:index + 1])[0]
+            valid[index] = True
+        except ValueError:
+            pass
+    return milliseconds, valid
+
+def read_index(filename):
+    """ The index of CSV file filename, or None if it hasn't got one
+    or the file has changed since it was built """
+    try:
+        with np.load(index_filename(filename)) as data:
+            stop = int(data["stop"])
+            index = TimeIndex(data["offset"], data["milliseconds"],
+                              None if stop < 0 else stop,
+                              int(data["size"]), int(data["mtime"]))
+        status = os.stat(filename)
+    except (OSError, ValueError, KeyError):
+        return None
+    if index.size != status.st_size or index.mtime != status.st_mtime_ns:
+        return None
+    return index
+
+def time_index(filename):
+    """ The index of CSV file filename, building it if need be, or None
+    if the file is compressed """
+    if detect_compression(filename) is not None:
+        return None
+    index = read_index(filename)
+    if index is None:
+        print(f"Building time index of {filename}")
+        index = build_index(filename)
+    return index
+
+class _RangeReader(io.RawIOBase):
+    """ Raw binary stream of the bytes of file fileobj from its current
+    position up to offset last, or the end of the file if that is None """
+
+    def __init__(self, fileobj, last):
+        super().__init__()
+        self.fileobj = fileobj
+        self.remaining = None if last is None else max(0, last - fileobj.tell())
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        if self.remaining is not None:
+            view = view[:self.remaining]
+        count = self.fileobj.readinto(view)
+        if self.remaining is not None:
+            self.remaining -= count
+        return count
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+def open_times(filename, start=None, end=None, newline=None):
+    """Open CSV file filename as a text file for reading the lines timed
+    from start up to end, milliseconds since the epoch from
+    parse_time_ms(), or None for the start or end of the file, using its
+    time index to skip the rest of the file.  The file may include some
+    lines either side of the range, so the times of the lines read must
+    still be checked.  newline is as for open().
+
+    """
+    if start is None and end is None:
+        return open_input(filename, newline=newline)
+    index = time_index(filename)
+    if index is None:
+        return open_input(filename, newline=newline)
+    first, last = index.byte_range(start, end)
+    return open_range(filename, first, last, newline=newline)
+
+def open_range(filename, first, last, newline=None):
+    """ Open bytes first up to last, or the end if that is None, of
+    file filename, which must not be compressed, as a text file for
+    reading.  newline is as for open() """
+    fh = open(filename, "rb")
+    fh.seek(first)
+    return io.TextIOWrapper(io.BufferedReader(_RangeReader(fh, last)), newline=newline)
+
+def main():
+    parser = argparse.ArgumentParser(description=
+                                     "Build the time index of accelerometer CSV files")
+    parser.add_argument("filename", help="Input filename", nargs="+")
+    parser.add_argument("--stride", help="Number of lines between the lines indexed",
+                        type=int, default=STRIDE)
+    args = parser.parse_args()
+    for filename in args.filename:
+        if detect_compression(filename) is not None:
+            print(f"{filename} is compressed, so can't be indexed", file=sys.stderr)
+            continue
+        index = build_index(filename, args.stride)
+        print(f"{index_filename(filename)}: {index.offset.size} lines indexed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+#
+# BSD 2-Clause License
+#
+# Copyright (c) 2020, Jason Leake
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Conversion of the timestamps in the CSV files, like
+# 2020-02-27 19:07:49.553, to times since the epoch, a whole array of
+# them at a time.  cwa.py writes the timestamps in UTC, so by default
+# they are converted as UTC, which gives the same times whatever the
+# time zone of the machine.  They can instead be taken as the local
+# time of a named time zone, e.g. Europe/London, or of the machine, as
+# Row.getEpoch() does.
+#
+# e.g.
+#
+# milliseconds = parse_timestamps(np.array(["2020-02-27 19:07:49.553"]))
+#
+
+import calendar
+from datetime import datetime, timedelta
+import numpy as np
+import os
+import time
+import zoneinfo
+
+# Take the timestamps as UTC
+UTC = "UTC"
+
+# Take the timestamps as the local time of the machine, as Row does
+LOCAL = "local"
+
+# Timestamps written by cwa.py are like 2020-02-27 19:07:49.553
+TIMESTAMP_LENGTH = 23
+
+# Position of each separator in a timestamp
+TIMESTAMP_SEPARATORS = { 4: "-", 7: "-", 10: " ", 13: ":", 16: ":", 19: "." }
+
+# A timestamp seen as its characters up to the "." and the three digits
+# of the milliseconds, to compare and decode them quickly
+TIMESTAMP_PARTS = np.dtype([("second", "<u8", (10,)), ("milliseconds", "<u4", (3,))])
+
+# Format of a timestamp without the milliseconds, for time.strptime()
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Number of days in each month of a year which isn't a leap year
+MONTH_DAYS = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+def timestamp_fields(timestamp):
+    """Split an array of timestamps like 2020-02-27 19:07:49.553 into
+    arrays of the year, month, day, hours, minutes, seconds and
+    milliseconds, or return None if they are not all in that form.
+
+    """
+    if timestamp.dtype != np.dtype(f"U{TIMESTAMP_LENGTH}"):
+        return None
+    codes = np.ascontiguousarray(timestamp).view(np.uint32).reshape(-1, TIMESTAMP_LENGTH)
+    for position, separator in TIMESTAMP_SEPARATORS.items():
+        if (codes[:, position] != ord(separator)).any():
+            return None
+    digits = np.delete(codes, list(TIMESTAMP_SEPARATORS), axis=1).astype(np.int64) - ord("0")
+    if ((digits < 0) | (digits > 9)).any():
+        return None
+    fields = []
+    start = 0
+    # Number of digits in each field
+    for width in (4, 2, 2, 2, 2, 2, 3):
+        fields.append(digits[:, start:start + width] @ 10 ** np.arange(width - 1, -1, -1))
+        start += width
+    return fields
+
+def split_timestamps(timestamp):
+    """Split an array of timestamps like 2020-02-27 19:07:49.553 into
+    int64 arrays of the seconds since the epoch, if the dates and times
+    are UTC, and of the milliseconds, and a mask of the timestamps which
+    are valid dates and times.  Returns None if they are not all in
+    that form.  The date and time are only decoded once for each run of
+    timestamps in the same second.
+
+    """
+    if timestamp.dtype != np.dtype(f"U{TIMESTAMP_LENGTH}") or timestamp.size == 0:
+        return None
+    timestamp = np.ascontiguousarray(timestamp)
+    parts = timestamp.view(TIMESTAMP_PARTS)
+    digits = parts["milliseconds"] - np.uint32(ord("0"))
+    if (digits > 9).any():
+        return None
+    milliseconds = (digits[:, 0] * 100 + digits[:, 1] * 10 + digits[:, 2]).astype(np.int64)
+    second = parts["second"]
+    starts = np.flatnonzero(np.concatenate(([True], (second[1:] != second[:-1]).any(axis=1))))
+    fields = timestamp_fields(timestamp[starts])
+    if fields is None:
+        return None
+    year, month, day, hours, minutes, seconds, unused = fields
+    valid = valid_dates(year, month, day, hours, minutes, seconds)
+    wall = (((days_from_civil(year, month, day) * 24 + hours) * 60 + minutes) * 60 +
+            seconds)
+    lengths = np.diff(np.append(starts, timestamp.size))
+    return np.repeat(wall, lengths), milliseconds, np.repeat(valid, lengths)
+
+def days_from_civil(year, month, day):
+    """ Number of days from 1970-01-01 to each date of the proleptic
+    Gregorian calendar given by the arrays year, month and day """
+    # Count years from March, so the leap day is the last of the year
+    year = year - (month <= 2)
+    era = year // 400
+    yearOfEra = year - era * 400
+    dayOfYear = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    dayOfEra = yearOfEra * 365 + yearOfEra // 4 - yearOfEra // 100 + dayOfYear
+    return era * 146097 + dayOfEra - 719468
+
+def valid_dates(year, month, day, hours, minutes, seconds):
+    """ Mask of the elements of the field arrays which are valid dates
+    and times """
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    monthDays = MONTH_DAYS[np.clip(month, 0, 12)] + ((month == 2) & leap)
+    return ((year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= monthDays) &
+            (hours < 24) & (minutes < 60) & (seconds < 60))
+
+def local_hours(hourFields):
+    """Start, in seconds since the epoch, of each local hour given by a
+    (year, month, day, hour) tuple of hourFields, from mktime(), and a
+    mask of the hours in which local time is unambiguous and doesn't
+    jump, so a time in them is the start plus its minutes and seconds.
+    An hour which is not a valid date has a NaN start.
+
+    """
+    hourStart = np.full(len(hourFields), np.nan)
+    steady = np.zeros(len(hourFields), dtype=bool)
+    for index, fields in enumerate(hourFields):
+        try:
+            datetime(*fields)
+        except ValueError:
+            continue
+        start = time.mktime(fields + (0, 0, 0, 0, -1))
+        hourStart[index] = start
+        steady[index] = (time.localtime(start)[:6] == fields + (0, 0) and
+                         time.localtime(start + 3599)[:6] == fields + (59, 59) and
+                         time.localtime(start - 3600)[:4] != fields and
+                         time.localtime(start + 3600)[:4] != fields)
+    return hourStart, steady
+
+def unique_runs(keys):
+    """ np.unique(keys, return_inverse=True), but quicker when keys is
+    mostly in runs of the same value, such as the hour of each of a
+    series of timestamps """
+    if keys.size == 0:
+        return keys, np.zeros(0, dtype=np.intp)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    runKeys, runInverse = np.unique(keys[starts], return_inverse=True)
+    return runKeys, np.repeat(runInverse, np.diff(np.append(starts, keys.size)))
+
+def parse_time(text):
+    """Convert a time given as "YYYY-MM-DD HH:MM:SS.fff", or a shorter
+    leading part of that such as "YYYY-MM-DD", to seconds since the
+    epoch, taking it as UTC, as cwa.py writes the timestamps.  None is
+    returned as None.
+
+    """
+    if text is None:
+        return None
+    timestring, dot, fraction = text.strip().partition('.')
+    for timeFormat in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            dateObject = time.strptime(timestring, timeFormat)
+            break
+        except ValueError:
+            pass
+    else:
+        raise ValueError(f"Bad time {text}, use YYYY-MM-DD HH:MM:SS")
+    return calendar.timegm(dateObject) + (float("0." + fraction) if fraction else 0)
+
+def parse_timestamps(timestamp, tz=UTC):
+    """ Convert an array of timestamps to int64 milliseconds since
+    1970-01-01 00:00:00 UTC, taking them as times in tz """
+    return TimestampParser(tz).milliseconds(timestamp)
+
+class TimestampParser:
+    """Converts arrays of timestamps to times since the epoch, taking
+    them as times in tz, which is UTC, the name of a time zone, e.g.
+    Europe/London, or LOCAL, for the local time of the machine, which
+    gives exactly the same times as Row.getEpoch().  A named time
+    zone's local times which happen twice, when the clocks go back, are
+    taken as the first of them.  Timestamps that are not dates and
+    times raise ValueError, as Row.getEpoch() does.
+
+    """
+
+    def __init__(self, tz=UTC):
+        self.tz = tz
+        # Raises zoneinfo.ZoneInfoNotFoundError for an unknown zone
+        self.zone = None if tz in (UTC, LOCAL) else zoneinfo.ZoneInfo(tz)
+        # Time of the last timestamp converted as local time, see local()
+        self.lastEpoch = None
+
+    def key(self):
+        """ What the times converted depend on, for the cache """
+        if self.tz == LOCAL:
+            return [self.tz, time.timezone, time.altzone, list(time.tzname),
+                    os.environ.get("TZ")]
+        return self.tz
+
+    def milliseconds(self, timestamp):
+        """ Convert an array of timestamps to int64 milliseconds since
+        the epoch """
+        if self.tz == LOCAL:
+            return np.round(self.local(timestamp) * 1000).astype(np.int64)
+        parts = split_timestamps(timestamp)
+        if parts is None:
+            return np.array([self._milliseconds(stamp) for stamp in timestamp.tolist()],
+                            dtype=np.int64)
+        wall, milliseconds, valid = parts
+        if self.zone is not None:
+            wall -= self._offsets(wall, valid)
+        result = wall * 1000 + milliseconds
+        # Converted one at a time, as Row does, which raises ValueError
+        # for those which aren't dates and times
+        for index in np.flatnonzero(~valid).tolist():
+            result[index] = self._milliseconds(str(timestamp[index]))
+        return result
+
+    def seconds(self, timestamp):
+        """ Convert an array of timestamps to float seconds since the
+        epoch, the whole seconds plus the milliseconds, as
+        Row.getEpoch() adds them """
+        if self.tz == LOCAL:
+            return self.local(timestamp)
+        milliseconds = self.milliseconds(timestamp)
+        return (milliseconds // 1000).astype(np.float64) + (milliseconds % 1000) / 1000
+
+    def _offsets(self, wall, valid):
+        """ UTC offsets, in seconds, of the zone at local times wall, in
+        seconds since the epoch as if they were UTC.  The offset is only
+        looked up for each hour, and for each second in an hour when it
+        changes """
+        offsets = np.zeros(wall.shape, dtype=np.int64)
+        validIndex = np.flatnonzero(valid)
+        hours, inverse = unique_runs(wall[validIndex] // 3600)
+        hourOffsets = np.zeros(hours.shape, dtype=np.int64)
+        changing = []
+        for index, hour in enumerate(hours.tolist()):
+            hourOffsets[index] = self._offset(hour * 3600)
+            if hourOffsets[index] != self._offset(hour * 3600 + 3599):
+                changing.append(index)
+        offsets[validIndex] = hourOffsets[inverse]
+        if changing:
+            rows = validIndex[np.isin(inverse, changing)]
+            seconds, secondInverse = np.unique(wall[rows], return_inverse=True)
+            secondOffsets = np.array([self._offset(second) for second in seconds.tolist()])
+            offsets[rows] = secondOffsets[secondInverse]
+        return offsets
+
+    def _offset(self, wall):
+        """ UTC offset, in seconds, of the zone at local time wall """
+        local = datetime(1970, 1, 1) + timedelta(seconds=wall)
+        return int(local.replace(tzinfo=self.zone).utcoffset().total_seconds())
+
+    def _milliseconds(self, timestamp):
+        """ Convert one timestamp, which strptime() must accept, to
+        milliseconds since the epoch """
+        timestring, dot, milliseconds = timestamp.partition('.')
+        fields = time.strptime(timestring, TIMESTAMP_FORMAT)
+        wall = calendar.timegm(fields)
+        if self.zone is not None:
+            # A leap second is the same as the next second
+            wall -= self._offset(calendar.timegm(fields[:5] + (min(fields[5], 59),)))
+        return wall * 1000 + int(milliseconds)
+
+    def local(self, timestamp):
+        """Convert an array of timestamps to seconds since the epoch,
+        taking them as local times as Row.getEpoch() does.  mktime()
+        is only called a few times for each hour in the timestamps,
+        rather than for each of them, except in an hour when the
+        clocks change.
+
+        """
+        parts = split_timestamps(timestamp)
+        if parts is None:
+            epochs = np.array([self._local(stamp) for stamp in timestamp.tolist()])
+            if epochs.size > 0:
+                self.lastEpoch = epochs[-1]
+            return epochs
+        wall, milliseconds, valid = parts
+        validIndex = np.flatnonzero(valid)
+        hours, inverse = unique_runs(wall[validIndex] // 3600)
+        hourStart, steady = local_hours(
+            [(datetime(1970, 1, 1) + timedelta(hours=hour)).timetuple()[:4]
+             for hour in hours.tolist()])
+        simple = np.zeros(timestamp.shape, dtype=bool)
+        simple[validIndex] = steady[inverse]
+        rows = np.flatnonzero(simple)
+        hourIndex = inverse[steady[inverse]]
+        epochs = np.empty(timestamp.shape)
+        epochs[rows] = ((hourStart[hourIndex] + wall[rows] % 3600) +
+                        milliseconds[rows] / 1000)
+        # mktime() resolves an ambiguous local time using the time zone
+        # offset of the previous call, so call it for the timestamp
+        # before each of these first, as converting one at a time does.
+        # The one before the first comes from the last array converted,
+        # and may be ambiguous itself, so it is given as an unambiguous
+        # time.
+        lastIndex = None
+        for index in np.flatnonzero(~simple).tolist():
+            if index == 0:
+                if self.lastEpoch is not None:
+                    time.mktime(time.localtime(self.lastEpoch))
+            elif index - 1 != lastIndex:
+                self._local(str(timestamp[index - 1]))
+            epochs[index] = self._local(str(timestamp[index]))
+            lastIndex = index
+        if epochs.size > 0:
+            self.lastEpoch = epochs[-1]
+        return epochs
+
+    def _local(self, timestamp):
+        """ Convert one timestamp, exactly as Row.getEpoch() does """
+        timestring, dot, milliseconds = timestamp.partition('.')
+        dateObject = time.strptime(timestring, TIMESTAMP_FORMAT)
+        return time.mktime(dateObject) + int(milliseconds) / 1000